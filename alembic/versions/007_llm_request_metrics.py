@@ -0,0 +1,32 @@
+"""Add model, token counts and timings to llm_requests
+
+Revision ID: 007_llm_request_metrics
+Revises: 2b348e606da6
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "007_llm_request_metrics"
+down_revision = "2b348e606da6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("llm_requests", sa.Column("model", sa.String(255), nullable=True))
+    op.add_column("llm_requests", sa.Column("prompt_tokens", sa.Integer(), nullable=True))
+    op.add_column("llm_requests", sa.Column("completion_tokens", sa.Integer(), nullable=True))
+    op.add_column("llm_requests", sa.Column("first_token_ms", sa.Integer(), nullable=True))
+    op.add_column("llm_requests", sa.Column("total_ms", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("llm_requests", "total_ms")
+    op.drop_column("llm_requests", "first_token_ms")
+    op.drop_column("llm_requests", "completion_tokens")
+    op.drop_column("llm_requests", "prompt_tokens")
+    op.drop_column("llm_requests", "model")
@@ -0,0 +1,35 @@
+"""Add llm_response_cache table and per-model cache opt-out
+
+Revision ID: 008_llm_response_cache
+Revises: 007_llm_request_metrics
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "008_llm_response_cache"
+down_revision = "007_llm_request_metrics"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "llm_response_cache",
+        sa.Column("key", sa.String(64), primary_key=True),
+        sa.Column("model", sa.String(255), nullable=False),
+        sa.Column("response", sa.Text, nullable=False),
+        sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column("expires_at", sa.DateTime, nullable=False),
+    )
+    op.create_index(op.f("ix_llm_response_cache_expires_at"), "llm_response_cache", ["expires_at"], unique=False)
+    op.add_column("llm_models", sa.Column("cache_enabled", sa.Boolean(), nullable=False, server_default=sa.true()))
+
+
+def downgrade():
+    op.drop_column("llm_models", "cache_enabled")
+    op.drop_index(op.f("ix_llm_response_cache_expires_at"), table_name="llm_response_cache")
+    op.drop_table("llm_response_cache")
@@ -0,0 +1,24 @@
+"""Add image_hash to llm_requests
+
+Revision ID: 009_llm_request_image_hash
+Revises: 008_llm_response_cache
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "009_llm_request_image_hash"
+down_revision = "008_llm_response_cache"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("llm_requests", sa.Column("image_hash", sa.String(64), nullable=True))
+
+
+def downgrade():
+    op.drop_column("llm_requests", "image_hash")
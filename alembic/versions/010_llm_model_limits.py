@@ -0,0 +1,26 @@
+"""Add per-model concurrency and queue limits to llm_models
+
+Revision ID: 010_llm_model_limits
+Revises: 009_llm_request_image_hash
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "010_llm_model_limits"
+down_revision = "009_llm_request_image_hash"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("llm_models", sa.Column("max_concurrency", sa.Integer(), nullable=True))
+    op.add_column("llm_models", sa.Column("max_queue", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("llm_models", "max_queue")
+    op.drop_column("llm_models", "max_concurrency")
@@ -0,0 +1,24 @@
+"""Add llm_weight to users for fair queuing of LLM requests
+
+Revision ID: 011_user_llm_weight
+Revises: 010_llm_model_limits
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "011_user_llm_weight"
+down_revision = "010_llm_model_limits"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("users", sa.Column("llm_weight", sa.Float(), server_default="1", nullable=False))
+
+
+def downgrade():
+    op.drop_column("users", "llm_weight")
@@ -0,0 +1,47 @@
+"""Add llm_jobs table for the durable LLM job queue
+
+Revision ID: 012_llm_jobs
+Revises: 011_user_llm_weight
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "012_llm_jobs"
+down_revision = "011_user_llm_weight"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "llm_jobs",
+        sa.Column("id", sa.Integer, primary_key=True, index=True),
+        sa.Column("user_id", sa.String, sa.ForeignKey("users.tg_id"), nullable=False),
+        sa.Column("update_data", sa.JSON, nullable=False),
+        sa.Column("prompt", sa.Text, nullable=False),
+        sa.Column("model", sa.String(255), nullable=True),
+        sa.Column("image_path", sa.String, nullable=True),
+        sa.Column("user_weight", sa.Float, nullable=False, server_default="1"),
+        sa.Column("status", sa.String(16), nullable=False, server_default="queued"),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("max_attempts", sa.Integer, nullable=False),
+        sa.Column("available_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column("locked_until", sa.DateTime, nullable=True),
+        sa.Column("worker_id", sa.String(64), nullable=True),
+        sa.Column("last_error", sa.Text, nullable=True),
+        sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column("finished_at", sa.DateTime, nullable=True),
+    )
+    # Частичные индексы под запрос захвата: свободные задания и задания с истёкшей видимостью
+    op.create_index("ix_llm_jobs_queued", "llm_jobs", ["available_at"], postgresql_where=sa.text("status = 'queued'"))
+    op.create_index("ix_llm_jobs_running", "llm_jobs", ["locked_until"], postgresql_where=sa.text("status = 'running'"))
+
+
+def downgrade():
+    op.drop_index("ix_llm_jobs_running", table_name="llm_jobs")
+    op.drop_index("ix_llm_jobs_queued", table_name="llm_jobs")
+    op.drop_table("llm_jobs")
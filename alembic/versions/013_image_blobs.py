@@ -0,0 +1,37 @@
+"""Add content-addressed image_blobs and link user_images to them
+
+Revision ID: 013_image_blobs
+Revises: 012_llm_jobs
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "013_image_blobs"
+down_revision = "012_llm_jobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "image_blobs",
+        sa.Column("sha256", sa.String(64), primary_key=True),
+        sa.Column("object_name", sa.String, nullable=False),
+        sa.Column("content_type", sa.String(64), nullable=False),
+        sa.Column("size", sa.Integer, nullable=False),
+        sa.Column("ref_count", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column("last_referenced_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    op.add_column("user_images", sa.Column("image_hash", sa.String(64), sa.ForeignKey("image_blobs.sha256"), nullable=True))
+    op.create_index(op.f("ix_user_images_image_hash"), "user_images", ["image_hash"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_user_images_image_hash"), table_name="user_images")
+    op.drop_column("user_images", "image_hash")
+    op.drop_table("image_blobs")
@@ -0,0 +1,24 @@
+"""Add image_delivery mode to llm_models
+
+Revision ID: 014_llm_model_image_delivery
+Revises: 013_image_blobs
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "014_llm_model_image_delivery"
+down_revision = "013_image_blobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("llm_models", sa.Column("image_delivery", sa.String(16), nullable=True))
+
+
+def downgrade():
+    op.drop_column("llm_models", "image_delivery")
@@ -0,0 +1,26 @@
+"""Add Telegram file_unique_id to user_images
+
+Revision ID: 015_user_image_file_unique_id
+Revises: 014_llm_model_image_delivery
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "015_user_image_file_unique_id"
+down_revision = "014_llm_model_image_delivery"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("user_images", sa.Column("file_unique_id", sa.String(), nullable=True))
+    op.create_index(op.f("ix_user_images_file_unique_id"), "user_images", ["file_unique_id"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_user_images_file_unique_id"), table_name="user_images")
+    op.drop_column("user_images", "file_unique_id")
@@ -0,0 +1,23 @@
+"""Index user_images.created_at for image retention
+
+Revision ID: 016_user_images_created_at_index
+Revises: 015_user_image_file_unique_id
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "016_user_images_created_at_index"
+down_revision = "015_user_image_file_unique_id"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f("ix_user_images_created_at"), "user_images", ["created_at"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_user_images_created_at"), table_name="user_images")
@@ -0,0 +1,24 @@
+"""Add image_paths to llm_jobs for albums
+
+Revision ID: 017_llm_job_image_paths
+Revises: 016_user_images_created_at_index
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "017_llm_job_image_paths"
+down_revision = "016_user_images_created_at_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("llm_jobs", sa.Column("image_paths", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("llm_jobs", "image_paths")
@@ -0,0 +1,24 @@
+"""Add source to llm_requests
+
+Revision ID: 018_llm_request_source
+Revises: 017_llm_job_image_paths
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "018_llm_request_source"
+down_revision = "017_llm_job_image_paths"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("llm_requests", sa.Column("source", sa.String(16), nullable=True))
+
+
+def downgrade():
+    op.drop_column("llm_requests", "source")
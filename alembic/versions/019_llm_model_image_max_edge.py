@@ -0,0 +1,24 @@
+"""Add image_max_edge to llm_models
+
+Revision ID: 019_llm_model_image_max_edge
+Revises: 018_llm_request_source
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "019_llm_model_image_max_edge"
+down_revision = "018_llm_request_source"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("llm_models", sa.Column("image_max_edge", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("llm_models", "image_max_edge")
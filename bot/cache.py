@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+from typing import Callable
+
+
+class LRUCache:
+    """
+    LRU-кэш в памяти процесса с ограничением по числу записей и (опционально) временем жизни.
+
+    Если задан max_bytes, суммарный размер значений (по функции sizeof) также ограничен:
+    самые старые записи вытесняются, пока кэш не уложится в бюджет, а значения больше
+    бюджета не кэшируются вовсе.
+
+    Не потокобезопасен: рассчитан на использование из одного event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl: float = None, max_bytes: int = None, sizeof: Callable = len):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._data = OrderedDict()  # key -> (expires_at, value, size)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value, _ = item
+        if expires_at is not None and expires_at < time.monotonic():
+            self.pop(key)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        self.pop(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (expires_at, value, size)
+        self.total_bytes += size
+        while len(self._data) > self.max_entries or (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self.total_bytes -= item[2]
+        return item[1]
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
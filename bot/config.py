@@ -3,8 +3,154 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def getenv_bool(name: str, default: bool = False) -> bool:
+    """Читает булеву переменную окружения ("1", "true", "yes", "on" считаются истиной)"""
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
     f"postgresql+asyncpg://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@{os.getenv('POSTGRES_HOST')}:{os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}",
 )
+
+# Профиль движка SQLAlchemy
+DB_ECHO = getenv_bool("DB_ECHO", False)  # Печать всех SQL-запросов (только для отладки)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # Дополнительных соединений сверх пула при пиках
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Ожидание свободного соединения, секунд
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Пересоздание соединений старше, секунд
+DB_POOL_PRE_PING = getenv_bool("DB_POOL_PRE_PING", False)  # Проверка соединения при выдаче из пула (лишний round trip)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))  # Кэш prepared statements asyncpg (0 — для pgbouncer в transaction mode)
+
+# Статистика SQL-запросов (/db_stats) и журнал медленных запросов
+DB_QUERY_SAMPLE_RATE = float(os.getenv("DB_QUERY_SAMPLE_RATE", "0.1"))  # Доля обновлений, по которым собирается статистика
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))  # Порог медленного запроса, мс (0 — не логировать)
+
+# Пул соединений HTTP-клиента LLM (один клиент на процесс)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP2 = getenv_bool("LLM_HTTP2", False)  # Требует установленного пакета h2
+
+# Таймауты по фазам запроса к LLM (в секундах)
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_WRITE_TIMEOUT = float(os.getenv("LLM_WRITE_TIMEOUT", "30"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))
+
+# Стриминг ответов LLM с прогрессивным редактированием сообщения
+LLM_STREAM = getenv_bool("LLM_STREAM", True)
+LLM_STREAM_INCLUDE_USAGE = getenv_bool("LLM_STREAM_INCLUDE_USAGE", True)  # stream_options.include_usage
+LLM_STREAM_EDIT_INTERVAL = float(os.getenv("LLM_STREAM_EDIT_INTERVAL", "1.5"))  # Не чаще одного edit за N секунд
+LLM_STREAM_EDIT_MIN_CHARS = int(os.getenv("LLM_STREAM_EDIT_MIN_CHARS", "40"))  # Минимальный прирост текста для edit
+
+# Кэш ответов LLM для одинаковых запросов (память + Postgres)
+LLM_CACHE_ENABLED = getenv_bool("LLM_CACHE_ENABLED", True)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))  # Время жизни записи в памяти, секунд
+LLM_CACHE_DB_TTL = float(os.getenv("LLM_CACHE_DB_TTL", "604800"))  # Время жизни записи в Postgres, секунд
+LLM_CACHE_PURGE_INTERVAL = float(os.getenv("LLM_CACHE_PURGE_INTERVAL", "3600"))  # Период удаления просроченных записей из Postgres, секунд (0 — не удалять)
+LLM_CACHE_HIT_COUNTS_QUOTA = getenv_bool("LLM_CACHE_HIT_COUNTS_QUOTA", True)  # Списывать ли запрос из лимита при попадании
+
+# Семантический кэш: ответ на перефразированный запрос по косинусной близости локальных векторов
+LLM_SEMANTIC_CACHE_ENABLED = getenv_bool("LLM_SEMANTIC_CACHE_ENABLED", False)
+LLM_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+LLM_SEMANTIC_CACHE_CAPACITY = int(os.getenv("LLM_SEMANTIC_CACHE_CAPACITY", "5000"))  # Максимум запросов в индексе
+LLM_SEMANTIC_CACHE_DIM = int(os.getenv("LLM_SEMANTIC_CACHE_DIM", "512"))  # Размерность векторов
+LLM_SEMANTIC_CACHE_TTL = float(os.getenv("LLM_SEMANTIC_CACHE_TTL", "86400"))  # Время жизни записи, секунд
+
+# Ограничение параллельных запросов к каждой модели (значения по умолчанию; переопределяются в llm_models)
+LLM_DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_DEFAULT_MAX_CONCURRENCY", "8"))
+LLM_DEFAULT_MAX_QUEUE = int(os.getenv("LLM_DEFAULT_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))  # Максимальное ожидание в очереди, секунд
+
+# Сколько обновлений Telegram бот обрабатывает одновременно: по умолчанию хватает на все слоты
+# и очередь к модели плюс запас для остальных обновлений, чтобы долгие запросы к LLM не блокировали бота
+BOT_CONCURRENT_UPDATES = int(
+    os.getenv("BOT_CONCURRENT_UPDATES", str(LLM_DEFAULT_MAX_CONCURRENCY + LLM_DEFAULT_MAX_QUEUE + 16))
+)
+
+# Справедливая очередь между пользователями (0 — без ограничения)
+LLM_USER_MAX_CONCURRENCY = int(os.getenv("LLM_USER_MAX_CONCURRENCY", "2"))  # Одновременных запросов одного пользователя
+LLM_USER_MAX_QUEUE = int(os.getenv("LLM_USER_MAX_QUEUE", "3"))  # Запросов одного пользователя в очереди к модели
+LLM_SUPERUSER_WEIGHT = float(os.getenv("LLM_SUPERUSER_WEIGHT", "4"))  # Вес суперпользователя (обычный вес — users.llm_weight)
+
+# Объединение одинаковых одновременных запросов к LLM в один вызов (singleflight)
+LLM_SINGLEFLIGHT_ENABLED = getenv_bool("LLM_SINGLEFLIGHT_ENABLED", True)
+
+# Очередь заданий LLM в Postgres: обработчики ставят задания, запросы к LLM выполняют процессы worker.py
+LLM_JOB_QUEUE_ENABLED = getenv_bool("LLM_JOB_QUEUE_ENABLED", False)
+LLM_JOB_MAX_ATTEMPTS = int(os.getenv("LLM_JOB_MAX_ATTEMPTS", "3"))
+LLM_JOB_VISIBILITY_TIMEOUT = float(os.getenv("LLM_JOB_VISIBILITY_TIMEOUT", "180"))  # Через сколько секунд без продления задание возвращается в очередь
+LLM_JOB_RETRY_DELAY = float(os.getenv("LLM_JOB_RETRY_DELAY", "5"))  # Базовая задержка перед повтором (удваивается), секунд
+LLM_JOB_POLL_INTERVAL = float(os.getenv("LLM_JOB_POLL_INTERVAL", "1"))  # Пауза воркера при пустой очереди, секунд
+LLM_WORKER_CONCURRENCY = int(os.getenv("LLM_WORKER_CONCURRENCY", "4"))  # Одновременных заданий в одном процессе воркера
+
+# Обращения к Minio: пул потоков и общий пул HTTP-соединений (потоков не больше, чем соединений)
+MINIO_IO_THREADS = int(os.getenv("MINIO_IO_THREADS", "8"))
+MINIO_MAX_CONNECTIONS = int(os.getenv("MINIO_MAX_CONNECTIONS", "16"))
+MINIO_CONNECT_TIMEOUT = float(os.getenv("MINIO_CONNECT_TIMEOUT", "10"))
+MINIO_READ_TIMEOUT = float(os.getenv("MINIO_READ_TIMEOUT", "120"))
+
+# Нормализация изображений перед сохранением и отправкой в LLM (поворот по EXIF, уменьшение, пережатие)
+IMAGE_NORMALIZE_ENABLED = getenv_bool("IMAGE_NORMALIZE_ENABLED", True)
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1568"))  # Максимальная длина большей стороны, пикселей
+# Сторона, которой хватает vision-модели: по ней выбирается размер фото Telegram (переопределяется в llm_models.image_max_edge)
+LLM_IMAGE_MAX_EDGE = int(os.getenv("LLM_IMAGE_MAX_EDGE", "1280"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").strip().lower()  # jpeg (jpg) | webp
+IMAGE_FORMAT = {"jpg": "jpeg"}.get(IMAGE_FORMAT, IMAGE_FORMAT)
+if IMAGE_FORMAT not in ("jpeg", "webp"):
+    raise ValueError(f"Unsupported IMAGE_FORMAT '{IMAGE_FORMAT}': expected jpeg or webp")
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", "2"))  # Процессов в пуле обработки изображений
+
+# Кэш недавно загруженных изображений в памяти (Minio используется после перезапуска или вытеснения)
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "1000"))
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", "900"))  # Время жизни записи, секунд
+
+# Альбомы: фото с одним media_group_id собираются, пока между ними проходит не больше окна, секунд
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.0"))
+
+# Хранение изображений и сборка мусора в Minio (фоновая задача бота, см. bot/image_gc.py)
+IMAGE_RETENTION_DAYS = float(os.getenv("IMAGE_RETENTION_DAYS", "0"))  # Через сколько дней удаляются записи user_images (0 — бессрочно)
+IMAGE_GC_GRACE_HOURS = float(os.getenv("IMAGE_GC_GRACE_HOURS", "24"))  # Сколько часов хранится blob без ссылок
+IMAGE_GC_INTERVAL = float(os.getenv("IMAGE_GC_INTERVAL", "21600"))  # Период запуска, секунд (0 — только вручную)
+IMAGE_GC_BATCH_SIZE = int(os.getenv("IMAGE_GC_BATCH_SIZE", "500"))  # Записей в одной транзакции
+
+# Передача изображений в LLM: base64 в теле запроса или короткоживущая presigned-ссылка Minio
+LLM_IMAGE_DELIVERY = os.getenv("LLM_IMAGE_DELIVERY", "base64").lower()  # base64 | url (переопределяется в llm_models.image_delivery)
+MINIO_PUBLIC_URL = os.getenv("MINIO_PUBLIC_URL", "")  # Адрес Minio, доступный провайдеру LLM, например https://files.example.com
+MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+LLM_IMAGE_URL_TTL = float(os.getenv("LLM_IMAGE_URL_TTL", "300"))  # Время жизни ссылки, секунд
+
+# Пул OpenAI-совместимых провайдеров (JSON-список, см. bot/llm_router.py); пусто — только LLM_API_BASE_URL
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+LLM_ROUTER_EWMA_ALPHA = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.3"))  # Вес нового замера в EWMA
+LLM_ROUTER_EXPLORE = float(os.getenv("LLM_ROUTER_EXPLORE", "0.05"))  # Доля запросов к не лучшему провайдеру
+LLM_ENDPOINT_EJECT_FAILURES = int(os.getenv("LLM_ENDPOINT_EJECT_FAILURES", "3"))  # Ошибок подряд до исключения
+LLM_ENDPOINT_EJECT_SECONDS = float(os.getenv("LLM_ENDPOINT_EJECT_SECONDS", "30"))  # На сколько исключается провайдер
+
+# Бюджет времени на запрос к LLM, повторы с джиттером и хеджирование медленных запросов
+LLM_REQUEST_DEADLINE = float(os.getenv("LLM_REQUEST_DEADLINE", "90"))  # Секунд до ответа (для стриминга — до первого токена), включая повторы
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # Повторов после первой попытки
+# Секунд на одну попытку (до ответа или первого токена); последняя попытка получает весь остаток бюджета
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "30"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))  # Базовая задержка перед повтором, секунд
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "4"))
+LLM_HEDGE_ENABLED = getenv_bool("LLM_HEDGE_ENABLED", True)
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))  # 0 — по перцентилю наблюдаемых задержек
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_HEDGE_INITIAL_DELAY = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "15"))  # Пока замеров мало
+
+# Кэш глобального флага LLM и списка моделей; сбрасывается через LISTEN/NOTIFY, перечитывается не реже интервала
+LLM_SETTINGS_REFRESH_INTERVAL = float(os.getenv("LLM_SETTINGS_REFRESH_INTERVAL", "300"))  # секунд
+
+# Кэш недавно зарегистрированных пользователей: повторные сообщения не обращаются к таблице users
+KNOWN_USERS_CACHE_SIZE = int(os.getenv("KNOWN_USERS_CACHE_SIZE", "10000"))
@@ -0,0 +1,107 @@
+import contextvars
+import random
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from bot.config import DB_QUERY_SAMPLE_RATE, DB_SLOW_QUERY_MS
+
+# Статистика SQL-запросов по выборке обновлений (доля DB_QUERY_SAMPLE_RATE):
+# число запросов и время на одно обновление, а также суммарное время по нормализованным запросам.
+# Запросы дольше DB_SLOW_QUERY_MS логируются целиком независимо от выборки.
+
+query_stats = {"updates": 0, "queries": 0, "total_ms": 0.0, "max_queries": 0, "slow_queries": 0}
+
+# Нормализованный запрос -> [число выполнений, суммарное время, максимальное время]
+statement_stats = {}
+_MAX_STATEMENTS = 500
+
+# Выборка текущего обновления (contextvar наследуется задачами и greenlet-ами SQLAlchemy)
+_current_sample = contextvars.ContextVar("query_sample", default=None)
+
+_WHITESPACE = re.compile(r"\s+")
+_PARAMETER = re.compile(r"\$\d+|%\(\w+\)s|%s|\b\d+\b|'(?:[^']|'')*'")
+_PARAMETER_LIST = re.compile(r"\(\?(?:, \?)+\)")
+
+
+class _QuerySample:
+    def __init__(self):
+        self.queries = 0
+        self.total_ms = 0.0
+        self.finished = False
+
+
+def normalize_statement(statement: str) -> str:
+    """Приводит запрос к виду без параметров и литералов, чтобы одинаковые запросы группировались"""
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _PARAMETER.sub("?", statement)
+    statement = _PARAMETER_LIST.sub("(...)", statement)
+    return statement[:300]
+
+
+def start_query_sample():
+    """Начинает сбор статистики запросов для текущего обновления (с вероятностью DB_QUERY_SAMPLE_RATE)"""
+    sampled = DB_QUERY_SAMPLE_RATE > 0 and random.random() < DB_QUERY_SAMPLE_RATE
+    _current_sample.set(_QuerySample() if sampled else None)
+
+
+def finish_query_sample():
+    """Завершает сбор статистики запросов для текущего обновления"""
+    sample = _current_sample.get()
+    if sample is None or sample.finished:
+        return
+    sample.finished = True
+    _current_sample.set(None)
+    query_stats["updates"] += 1
+    query_stats["queries"] += sample.queries
+    query_stats["total_ms"] += sample.total_ms
+    query_stats["max_queries"] = max(query_stats["max_queries"], sample.queries)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+
+    if DB_SLOW_QUERY_MS > 0 and elapsed_ms >= DB_SLOW_QUERY_MS:
+        query_stats["slow_queries"] += 1
+        print(f"Slow query ({elapsed_ms:.0f} ms): {statement} | parameters: {str(parameters)[:500]}")
+
+    sample = _current_sample.get()
+    if sample is None or sample.finished:
+        return
+    sample.queries += 1
+    sample.total_ms += elapsed_ms
+    key = normalize_statement(statement)
+    stats = statement_stats.get(key)
+    if stats is None:
+        if len(statement_stats) >= _MAX_STATEMENTS:
+            return
+        stats = statement_stats[key] = [0, 0.0, 0.0]
+    stats[0] += 1
+    stats[1] += elapsed_ms
+    stats[2] = max(stats[2], elapsed_ms)
+
+
+def _handle_error(context):
+    # Запрос завершился ошибкой: after_cursor_execute не вызывается, снимаем отметку времени
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine: AsyncEngine):
+    """Подключает сбор статистики запросов к движку"""
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+def top_statements(limit: int = 5) -> list:
+    """Нормализованные запросы с наибольшим суммарным временем: список (запрос, число, всего мс, макс мс)"""
+    ordered = sorted(statement_stats.items(), key=lambda item: item[1][1], reverse=True)
+    return [(statement, count, total_ms, max_ms) for statement, (count, total_ms, max_ms) in ordered[:limit]]
@@ -1,16 +1,49 @@
+import asyncio
 import os
+import time
 from datetime import datetime, timedelta
 
+import openai
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.future import select
 from sqlalchemy.orm import joinedload
 from telegram import Update
-from telegram.ext import CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, filters
-
+from telegram.constants import ChatAction
+from telegram.ext import CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
+
+from bot.config import (
+    IMAGE_GC_GRACE_HOURS,
+    IMAGE_MAX_EDGE,
+    IMAGE_RETENTION_DAYS,
+    KNOWN_USERS_CACHE_SIZE,
+    LLM_CACHE_HIT_COUNTS_QUOTA,
+    LLM_JOB_QUEUE_ENABLED,
+    LLM_SINGLEFLIGHT_ENABLED,
+    LLM_STREAM,
+    LLM_SUPERUSER_WEIGHT,
+    MEDIA_GROUP_WINDOW,
+)
+from bot.cache import LRUCache
 from bot.database import async_session
+from bot.db_metrics import finish_query_sample, query_stats, start_query_sample, top_statements
+from bot.image_gc import collect_image_garbage, image_gc_report, image_gc_running
+from bot.image_store import add_telegram_photos, combine_image_hashes, get_image_hash, images_for_llm
+from bot.images import pick_photo_size
 from bot.keyboards import get_admin_control_keyboard, get_admin_reply_keyboard, get_categories_inline_keyboard, get_main_reply_keyboard, get_subtopics_inline_keyboard, get_users_keyboard, get_user_actions_keyboard, get_llm_models_keyboard
-from bot.llm import get_llm_response
-from bot.models import Category, Feedback, LLMConfig, LLMRequest, LLMUsage, Log, Subtopic, User, UserImage, LLMModel
-from bot.storage import image_to_base64, save_image
+from bot.llm import LLMResult, LLMStreamInterrupted, get_llm_completion, image_data_url, resolve_model
+from bot.llm_cache import cache_stats, get_cached_response, make_cache_key, store_cached_response
+from bot.llm_jobs import enqueue_llm_job, llm_job_stats
+from bot.llm_precheck import LLMPrecheck, get_llm_precheck
+from bot.llm_quota import refund_llm_quota, reserve_llm_quota
+from bot.llm_router import is_retryable_error
+from bot.llm_scheduler import LLMBusyError, llm_slot
+from bot.llm_settings import get_model_settings, list_models, notify_llm_settings_changed
+from bot.media_groups import MediaGroupCollector
+from bot.models import Category, Feedback, LLMConfig, LLMRequest, LLMUsage, Log, Subtopic, User, LLMModel
+from bot.semantic_cache import find_similar_response, remember_response
+from bot.singleflight import SingleFlight
+from bot.storage import image_to_base64
+from bot.streaming import StreamingReply, reply_text_chunked
 
 # Простой in‑memory rate limiting (5 запросов в минуту)
 user_requests = {}
@@ -19,15 +52,28 @@ SUPERUSER_TG_ID = os.getenv("SUPERUSER_TG_ID")  # Суперпользовате
 SUPERUSER_TG_NICK = os.getenv("SUPERUSER_TG_NICK")  # Суперпользовательский TG Nick из .env
 SUPERUSER_TG_NAME = os.getenv("SUPERUSER_TG_NAME")  # Имя суперпользователя
 
+# Объединение одинаковых одновременных запросов к LLM
+llm_flights = SingleFlight()
+
 # Словарь для хранения последних загруженных изображений пользователей
 user_last_image = {}
 
+# Обновления обрабатываются параллельно (BOT_CONCURRENT_UPDATES), поэтому вопрос, пришедший
+# сразу после фото без подписи, дожидается его загрузки: tg_id -> список asyncio.Event
+pending_uploads = {}
+# Загрузки альбомов: (chat_id, media_group_id) -> asyncio.Event
+album_uploads = {}
+_UPLOAD_WAIT_TIMEOUT = 60  # секунд
+
 # Словарь для хранения текущей страницы пользователей для каждого администратора
 admin_user_pages = {}
 
 # Словарь для хранения выбранного пользователя для каждого администратора
 selected_users = {}
 
+# Недавно зарегистрированные пользователи: tg_id -> (full_name, username)
+known_users = LRUCache(KNOWN_USERS_CACHE_SIZE)
+
 
 async def check_rate_limit(user_id: int) -> bool:
     now = datetime.utcnow()
@@ -41,26 +87,63 @@ async def check_rate_limit(user_id: int) -> bool:
     return True
 
 
+def begin_upload(user_id: str) -> asyncio.Event:
+    """Отмечает, что у пользователя идёт загрузка фотографий"""
+    event = asyncio.Event()
+    pending_uploads.setdefault(user_id, []).append(event)
+    return event
+
+
+def end_upload(user_id: str, event: asyncio.Event):
+    """Снимает отметку begin_upload"""
+    event.set()
+    events = pending_uploads.get(user_id)
+    if events is not None and event in events:
+        events.remove(event)
+        if not events:
+            del pending_uploads[user_id]
+
+
+async def wait_for_uploads(user_id: str):
+    """Дожидается загрузок фотографий пользователя, начатых до его вопроса"""
+    events = list(pending_uploads.get(user_id, ()))
+    if not events:
+        return
+    try:
+        await asyncio.wait_for(asyncio.gather(*(event.wait() for event in events)), _UPLOAD_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+
+
 async def register_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     tg_id = str(user.id)
     full_name = user.first_name + (" " + user.last_name if user.last_name else "")
     username = user.username
     phone = None  # Телефон не передаётся автоматически
+    # Пользователь уже зарегистрирован в этом процессе и не менял имя — обращение к БД не нужно
+    if known_users.get(tg_id) == (full_name, username):
+        return
+    # Одним запросом: новый пользователь создаётся, у существующего обновляются имя и username,
+    # если они изменились; одновременные обновления от нового пользователя не конфликтуют
+    statement = insert(User).values(
+        tg_id=tg_id,
+        full_name=full_name,
+        phone=phone,
+        username=username,
+        llm_model=os.getenv("LLM_API_MODEL"),  # Устанавливаем модель по умолчанию
+        llm_enabled=True,  # По умолчанию LLM включен для пользователя
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[User.tg_id],
+        set_={"full_name": statement.excluded.full_name, "username": statement.excluded.username},
+        where=(User.full_name.is_distinct_from(statement.excluded.full_name))
+        | (User.username.is_distinct_from(statement.excluded.username)),
+    )
     async with async_session() as session:
-        result = await session.execute(select(User).where(User.tg_id == tg_id))
-        existing_user = result.scalar_one_or_none()
-        if not existing_user:
-            new_user = User(
-                tg_id=tg_id, 
-                full_name=full_name, 
-                phone=phone, 
-                username=username,
-                llm_model=os.getenv("LLM_API_MODEL"),  # Устанавливаем модель по умолчанию
-                llm_enabled=True  # По умолчанию LLM включен для пользователя
-            )
-            session.add(new_user)
-            await session.commit()
+        await session.execute(statement)
+        await session.commit()
+    known_users.set(tg_id, (full_name, username))
 
 
 # Обработчик команды /start
@@ -97,32 +180,23 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def about_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
-    # Получаем информацию о модели LLM пользователя
+    # Получаем информацию о модели LLM пользователя, глобальном состоянии LLM и лимите (одним запросом)
     llm_model_info = ""
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.tg_id == str(user_id)))
-        user = result.scalar_one_or_none()
-        if user:
-            model_name = user.llm_model if user.llm_model else os.getenv('LLM_API_MODEL')
-            llm_enabled = "включена" if user.llm_enabled else "отключена"
-            
-            # Получаем информацию о глобальном состоянии LLM
-            config_result = await session.execute(select(LLMConfig))
-            config = config_result.scalars().first()
-            global_enabled = config is not None and config.enabled
-            
-            # Получаем информацию о лимите запросов
-            usage_result = await session.execute(select(LLMUsage).where(LLMUsage.user_id == str(user_id)))
-            usage = usage_result.scalar_one_or_none()
-            limit_info = ""
-            if usage:
-                limit_info = f"Использовано {usage.used} из {usage.limit} запросов."
-            
-            llm_model_info = f"\n\n<b>Ваша модель LLM:</b> {model_name}\n"
-            llm_model_info += f"<b>Статус LLM для вас:</b> {llm_enabled}\n"
-            llm_model_info += f"<b>Глобальный статус LLM:</b> {'включена' if global_enabled else 'отключена'}\n"
-            if limit_info:
-                llm_model_info += f"<b>{limit_info}</b>"
+    precheck = await get_llm_precheck(str(user_id))
+    user = precheck.user
+    if user:
+        model_name = user.llm_model if user.llm_model else os.getenv('LLM_API_MODEL')
+        llm_enabled = "включена" if user.llm_enabled else "отключена"
+        
+        limit_info = ""
+        if precheck.usage:
+            limit_info = f"Использовано {precheck.usage.used} из {precheck.usage.limit} запросов."
+        
+        llm_model_info = f"\n\n<b>Ваша модель LLM:</b> {model_name}\n"
+        llm_model_info += f"<b>Статус LLM для вас:</b> {llm_enabled}\n"
+        llm_model_info += f"<b>Глобальный статус LLM:</b> {'включена' if precheck.global_enabled else 'отключена'}\n"
+        if limit_info:
+            llm_model_info += f"<b>{limit_info}</b>"
     
     about_text = (
         "<b>О боте</b>\n"
@@ -382,8 +456,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 
             # Проверяем, выбрана ли модель из списка
             async with async_session() as session:
-                models_result = await session.execute(select(LLMModel))
-                models = models_result.scalars().all()
+                models = await list_models()
                 
                 for model in models:
                     model_display = f"{model.name} - {model.description}"
@@ -445,6 +518,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     # Создаем новую модель
                     new_model = LLMModel(name=model_name, description=model_description)
                     session.add(new_model)
+                    await notify_llm_settings_changed(session)
                     await session.commit()
                     
                     # Если есть выбранный пользователь, устанавливаем ему эту модель
@@ -508,6 +582,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     session.add(config)
                 else:
                     config.enabled = True
+                await notify_llm_settings_changed(session)
                 await session.commit()
             await update.message.reply_text("LLM функция включена.")
             return
@@ -522,6 +597,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     session.add(config)
                 else:
                     config.enabled = False
+                await notify_llm_settings_changed(session)
                 await session.commit()
             await update.message.reply_text("LLM функция отключена.")
             return
@@ -595,129 +671,465 @@ async def subtopic_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.message.reply_text("Подтема не найдена.", parse_mode="HTML")
 
 
+# Сохраняет запрос и ответ в БД (лимит уже зарезервирован в reserve_llm_request)
+async def save_llm_request(user_id: str, prompt: str, result: LLMResult, image_hash: str = None):
+    async with async_session() as session:
+        llm_req = LLMRequest(
+            user_id=user_id,
+            prompt=prompt,
+            response=result.text,
+            model=result.model,
+            prompt_tokens=result.prompt_tokens,
+            completion_tokens=result.completion_tokens,
+            first_token_ms=result.first_token_ms,
+            total_ms=result.total_ms,
+            image_hash=image_hash,
+            source=result.source,
+        )
+        session.add(llm_req)
+        await session.commit()
+
+
+# Общий путь запроса к LLM: кэш, стриминг/обычный ответ, сохранение запроса и учёт лимита
+async def find_cached_answer(prompt: str, model_name: str, image_hash: str = None) -> LLMResult | None:
+    """
+    Ищет ответ в кэше: точном, а для текстовых запросов — и в семантическом
+    """
+    started = time.monotonic()
+    cached_text = await get_cached_response(model_name, prompt, image_hash)
+    if cached_text is None and image_hash is None:
+        # Перефразированные текстовые запросы — из семантического кэша
+        cached_text = await find_similar_response(model_name, prompt)
+    if cached_text is None:
+        return None
+    return LLMResult(text=cached_text, model=model_name, total_ms=int((time.monotonic() - started) * 1000), source="cache")
+
+
+async def answer_from_cache(update: Update, prompt: str, model_name: str, image_hash: str = None) -> bool:
+    """
+    Отвечает на запрос из кэша без резервирования лимита (LLM_CACHE_HIT_COUNTS_QUOTA=false)
+
+    Returns:
+        True, если ответ найден и отправлен пользователю
+    """
+    result = await find_cached_answer(prompt, model_name, image_hash)
+    if result is None:
+        return False
+    await reply_text_chunked(update.message, result.text)
+    await save_llm_request(str(update.effective_user.id), prompt, result, image_hash)
+    return True
+
+
+class _QuotaReservation:
+    """Запрос из лимита пользователя, зарезервированный до ответа (reserve_llm_request)"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.held = True
+
+    def settle(self):
+        # Ответ доставлен — запрос списан окончательно
+        self.held = False
+
+    async def refund(self):
+        if self.held:
+            self.held = False
+            await refund_llm_quota(self.user_id)
+
+
+async def answer_with_llm(
+    update: Update,
+    prompt: str,
+    user_model: str = None,
+    image_path: str = None,
+    user_weight: float = 1.0,
+    retrying: bool = False,
+    image_hash: str = None,
+    image_paths: list = None,
+    check_cache: bool = True,
+) -> bool:
+    """
+    Отвечает на запрос пользователя с помощью LLM
+
+    Запрос из лимита пользователя резервируется заранее (reserve_llm_request) и возвращается,
+    если ответ не доставлен — при любой ошибке или отмене. При retrying=True лимит при ошибке
+    не возвращается: задание будет повторено, а после последней попытки лимит вернёт она сама.
+
+    Args:
+        image_path: Изображение в Minio, если оно есть в запросе (загружается, только если ответа нет в кэше)
+        image_paths: Несколько изображений в Minio (альбом) — передаются в одном запросе
+        image_hash: SHA-256 изображения (для нескольких — combine_image_hashes), если уже известен
+        retrying: Если True, временные ошибки (перегрузка, таймаут, сеть, 5xx, 429) пробрасываются,
+            чтобы очередь заданий повторила запрос позже; пользователь видит сообщение о повторе
+        check_cache: False, если кэш уже проверен вызывающим (до резервирования лимита)
+
+    Returns:
+        True, если пользователь получил ответ
+    """
+    reservation = _QuotaReservation(str(update.effective_user.id))
+    try:
+        answered = await _answer_with_llm(
+            update, reservation, prompt, user_model, image_path, user_weight, retrying, image_hash, image_paths, check_cache
+        )
+    except BaseException:
+        if not retrying:
+            await reservation.refund()
+        raise
+    if not answered:
+        await reservation.refund()
+    return answered
+
+
+async def _answer_with_llm(
+    update: Update,
+    reservation: _QuotaReservation,
+    prompt: str,
+    user_model: str,
+    image_path: str,
+    user_weight: float,
+    retrying: bool,
+    image_hash: str,
+    image_paths: list,
+    check_cache: bool,
+) -> bool:
+    user_id = update.effective_user.id
+    model_name = resolve_model(user_model)
+    # Суперпользователь (докладчик) обслуживается в очереди к LLM в приоритете
+    if str(user_id) == SUPERUSER_TG_ID:
+        user_weight = max(user_weight, LLM_SUPERUSER_WEIGHT)
+    image_paths = list(image_paths or ([image_path] if image_path else []))
+    if image_hash is None and image_paths:
+        image_hash = combine_image_hashes([await get_image_hash(path) for path in image_paths])
+
+    # Одинаковые запросы отдаём из кэша без обращения к LLM
+    result = await find_cached_answer(prompt, model_name, image_hash) if check_cache else None
+    if result is not None:
+        if not LLM_CACHE_HIT_COUNTS_QUOTA:
+            # Ответ из кэша не списывается из лимита
+            await reservation.refund()
+        await reply_text_chunked(update.message, result.text)
+        reservation.settle()
+        await save_llm_request(str(user_id), prompt, result, image_hash)
+        return True
+
+    reply = StreamingReply(update.message) if LLM_STREAM else None
+
+    async def on_queued(position: int):
+        status = f"⏳ Много запросов к модели. Ваша позиция в очереди: {position}"
+        if reply is not None:
+            await reply.set_status(status)
+        else:
+            await update.message.reply_text(status, reply_to_message_id=update.message.message_id)
+
+    async def notify_retry():
+        retry_text = "⏳ Модель сейчас недоступна, запрос будет автоматически повторён."
+        if reply is not None:
+            await reply.fail(retry_text)
+        else:
+            await update.message.reply_text(retry_text, reply_to_message_id=update.message.message_id)
+
+    async def call_llm(on_delta):
+        images = await images_for_llm(model_name, image_paths) if image_paths else None
+        async with llm_slot(model_name, user_id=str(user_id), weight=user_weight, on_queued=on_queued):
+            try:
+                return await get_llm_completion(prompt, model=model_name, on_delta=on_delta, images=images)
+            except openai.BadRequestError:
+                if not images or all(url.startswith("data:") for url in images):
+                    raise
+                # Провайдер не смог скачать изображение по ссылке — повторяем с base64
+                print(f"LLM rejected image URL for model '{model_name}', retrying with base64")
+                images = [image_data_url(await image_to_base64(path)) for path in image_paths]
+                return await get_llm_completion(prompt, model=model_name, on_delta=on_delta, images=images)
+
+    try:
+        if reply is not None:
+            await reply.start()
+        if LLM_SINGLEFLIGHT_ENABLED:
+            # Одинаковые запросы, пришедшие одновременно, ждут один общий вызов LLM
+            flight_key = make_cache_key(model_name, prompt, image_hash)
+            result, shared = await llm_flights.do(flight_key, call_llm, on_delta=reply.update if reply is not None else None)
+        else:
+            result, shared = await call_llm(reply.update if reply is not None else None), False
+    except LLMStreamInterrupted as e:
+        # Часть ответа уже показана — оставляем её, а не заменяем сообщением об ошибке
+        async with async_session() as session:
+            log = Log(user_id=str(user_id), message=f"Ответ LLM прерван. User:{user_id}, Model:{model_name}, Error:{e}")
+            session.add(log)
+            await session.commit()
+        partial_text = f"{e.text}\n\n⚠️ Ответ прерван из-за ошибки LLM API."
+        if reply is not None:
+            await reply.finish(partial_text)
+        else:
+            await reply_text_chunked(update.message, partial_text)
+        reservation.settle()
+        await save_llm_request(str(user_id), prompt, LLMResult(text=e.text, model=model_name, source="partial"), image_hash)
+        return True
+    except LLMBusyError as e:
+        if retrying:
+            await notify_retry()
+            raise
+        async with async_session() as session:
+            log = Log(user_id=str(user_id), message=f"LLM перегружена. User:{user_id}, Model:{model_name}, Error:{e}")
+            session.add(log)
+            await session.commit()
+        busy_text = "Сейчас слишком много запросов к модели. Попробуйте ещё раз через минуту."
+        if reply is not None:
+            await reply.fail(busy_text)
+        else:
+            await update.message.reply_text(busy_text, reply_to_message_id=update.message.message_id)
+        return False
+    except Exception as e:
+        if retrying and (isinstance(e, asyncio.TimeoutError) or is_retryable_error(e)):
+            await notify_retry()
+            raise
+        async with async_session() as session:
+            log = Log(user_id=str(user_id), message=f"Ошибка при обращении к LLM API. User:{user_id}, Error:{e}")
+            session.add(log)
+            await session.commit()
+        if reply is not None:
+            await reply.fail("Ошибка при обращении к LLM API.")
+        else:
+            await update.message.reply_text(
+                "Ошибка при обращении к LLM API.",
+                reply_to_message_id=update.message.message_id,
+            )
+        return False
+
+    if reply is not None:
+        await reply.finish(result.text)
+    else:
+        await reply_text_chunked(update.message, result.text)
+    # Ответ доставлен: дальнейшие ошибки (сохранение истории, кэш) лимит не возвращают
+    reservation.settle()
+
+    await save_llm_request(str(user_id), prompt, result, image_hash)
+
+    # Кэш заполняет только тот, кто фактически обращался к LLM
+    if not shared:
+        await store_cached_response(model_name, prompt, result.text, image_hash)
+        if image_hash is None:
+            await remember_response(model_name, prompt, result.text)
+    return True
+
+
+async def check_llm_access(update: Update, precheck: LLMPrecheck) -> bool:
+    """
+    Проверяет, включена ли LLM глобально и для пользователя, и сообщает пользователю причину отказа
+    """
+    if not precheck.global_enabled:
+        await update.message.reply_text("LLM функция временно отключена.")
+        return False
+
+    if precheck.user is None or not precheck.user.llm_enabled:
+        await update.message.reply_text("LLM функция отключена для вашего аккаунта.")
+        return False
+    return True
+
+
+async def reserve_llm_request(update: Update, precheck: LLMPrecheck) -> bool:
+    """
+    Резервирует запрос из лимита пользователя или сообщает, что лимит исчерпан
+
+    Если у пользователя ещё нет записи с лимитом, она создаётся с лимитом DEFAULT_LIMIT_LLM.
+    Зарезервированный запрос возвращается в answer_with_llm (или ask_llm),
+    если ответ не доставлен.
+    """
+    # Атомарно: одновременные запросы пользователя не превысят лимит
+    if not await reserve_llm_quota(precheck.user.tg_id):
+        await update.message.reply_text(
+            f"Вы исчерпали лимит запросов. Для увеличения обратитесь к @{SUPERUSER_TG_NICK}",
+            reply_to_message_id=update.message.message_id,
+        )
+        return False
+    return True
+
+
 # Новый обработчик для фотографий
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
+    message = update.message
+    if message.media_group_id:
+        # Фото альбома собираются и обрабатываются вместе (media_group_handler)
+        key = (message.chat_id, message.media_group_id)
+        if media_groups.add(key, update):
+            album_uploads[key] = begin_upload(str(user_id))
+            await register_user(update, context)  # Автоматическая регистрация пользователя
+            if not await check_rate_limit(user_id):
+                media_groups.reject(key)
+                end_upload(str(user_id), album_uploads.pop(key))
+                await message.reply_text("Слишком много запросов. Пожалуйста, подождите.")
+        return
+
+    upload = begin_upload(str(user_id))
+    try:
+        await _handle_photo(update, context)
+    finally:
+        end_upload(str(user_id), upload)
+
+
+async def photo_max_edge(user_id: str) -> int:
+    """Разрешение изображений, которого хватает модели пользователя: по нему выбирается размер фото Telegram"""
+    async with async_session() as session:
+        result = await session.execute(select(User.llm_model).where(User.tg_id == user_id))
+        user_model = result.scalar_one_or_none()
+    settings = await get_model_settings(resolve_model(user_model))
+    # Больше IMAGE_MAX_EDGE не нужно: изображение всё равно будет уменьшено при нормализации
+    return min(settings.image_max_edge, IMAGE_MAX_EDGE)
+
+
+async def _handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    message = update.message
     await register_user(update, context)  # Автоматическая регистрация пользователя
     if not await check_rate_limit(user_id):
-        await update.message.reply_text("Слишком много запросов. Пожалуйста, подождите.")
+        await message.reply_text("Слишком много запросов. Пожалуйста, подождите.")
         return
 
-    # Получаем фото с наилучшим качеством
-    photo_file = await update.message.photo[-1].get_file()
-    photo_bytes = await photo_file.download_as_bytearray()
-    
-    # Получаем подпись к фотографии (если есть)
-    caption = update.message.caption
-    
-    # Сохраняем изображение в Minio
     try:
-        image_path = await save_image(photo_bytes, str(user_id))
+        # Наименьший размер фото, которого хватает модели пользователя
+        photo = pick_photo_size(message.photo, await photo_max_edge(str(user_id)))
+
+        # Сохраняем изображение в Minio (одинаковые изображения хранятся одним объектом) и в БД;
+        # повторно присланное или пересланное фото не скачивается и не загружается заново
+        [user_image] = await add_telegram_photos(str(user_id), [photo])
+        image_path = user_image.image_path
         
-        # Сохраняем информацию о загруженном изображении в БД
         async with async_session() as session:
-            user_image = UserImage(user_id=str(user_id), image_path=image_path)
-            session.add(user_image)
-            await session.commit()
-            
             # Логируем загрузку изображения
             log = Log(user_id=str(user_id), message=f"Uploaded image: {image_path}")
             session.add(log)
             await session.commit()
-        
-        # Проверяем, есть ли подпись к фотографии
-        if caption:
-            # Если есть подпись, сразу отправляем запрос в LLM
-            # Проверка, включена ли LLM-функциональность глобально и для пользователя
-            async with async_session() as session:
-                config_result = await session.execute(select(LLMConfig))
-                config = config_result.scalars().first()
-                if config is None or not config.enabled:
-                    await update.message.reply_text("LLM функция временно отключена.")
-                    return
-                
-                # Проверка, включена ли LLM-функциональность для конкретного пользователя
-                user_result = await session.execute(select(User).where(User.tg_id == str(user_id)))
-                user = user_result.scalar_one_or_none()
-                if user is None or not user.llm_enabled:
-                    await update.message.reply_text("LLM функция отключена для вашего аккаунта.")
-                    return
 
-                # Получаем или создаём запись с лимитом для пользователя
-                result = await session.execute(select(LLMUsage).where(LLMUsage.user_id == str(user_id)))
-                usage = result.scalar_one_or_none()
-                if usage is None:
-                    usage = LLMUsage(user_id=str(user_id), used=0, limit=int(os.getenv("DEFAULT_LIMIT_LLM")))
-                    session.add(usage)
-                    await session.commit()
-                if usage.used >= usage.limit:
-                    await update.message.reply_text(
-                        f"Вы исчерпали лимит запросов. Для увеличения обратитесь к @{SUPERUSER_TG_NICK}",
-                        reply_to_message_id=update.message.message_id,
-                    )
-                    return
-                
-                # Получаем модель LLM для пользователя
-                user_model = user.llm_model
-            
-            # Конвертируем изображение в base64
-            try:
-                image_base64 = await image_to_base64(image_path)
-                
-                # Получаем ответ от LLM
-                response_text = await get_llm_response(caption, model=user_model, image_base64=image_base64)
-                
-                # Сохраняем запрос и ответ в БД и увеличиваем счётчик использования
-                async with async_session() as session:
-                    llm_req = LLMRequest(user_id=str(user_id), prompt=caption, response=response_text)
-                    session.add(llm_req)
-                    # Обновляем лимит
-                    result = await session.execute(select(LLMUsage).where(LLMUsage.user_id == str(user_id)))
-                    usage = result.scalar_one_or_none()
-                    if usage:
-                        usage.used += 1
-                    await session.commit()
-                
-                # Отправляем ответ пользователю
-                await update.message.reply_text(
-                    response_text,
-                    parse_mode="HTML",
-                    reply_to_message_id=update.message.message_id,
-                )
-            except Exception as e:
-                async with async_session() as session:
-                    log = Log(user_id=str(user_id), message=f"Error processing image with caption for LLM: {str(e)}")
-                    session.add(log)
-                    await session.commit()
-                await update.message.reply_text(
-                    f"Произошла ошибка при обработке запроса: {str(e)}",
-                    reply_to_message_id=update.message.message_id,
-                )
-        else:
-            # Если нет подписи, сохраняем изображение для следующего запроса
-            user_last_image[str(user_id)] = image_path
-            
-            # Проверяем, включена ли LLM-функциональность для пользователя
-            async with async_session() as session:
-                user_result = await session.execute(select(User).where(User.tg_id == str(user_id)))
-                user = user_result.scalar_one_or_none()
-                
-                if user and user.llm_enabled:
-                    await update.message.reply_text(
-                        "Изображение успешно загружено. Теперь вы можете задать вопрос о нём, и я отправлю его вместе с вашим запросом в LLM."
-                    )
-                else:
-                    await update.message.reply_text(
-                        "Изображение успешно загружено. Обратите внимание, что функция LLM отключена для вашего аккаунта."
-                    )
+        await handle_uploaded_images(update, message.caption, [image_path], user_image.image_hash)
     except Exception as e:
-        await update.message.reply_text(f"Произошла ошибка при загрузке изображения: {str(e)}")
+        await message.reply_text(f"Произошла ошибка при загрузке изображения: {str(e)}")
         async with async_session() as session:
             log = Log(user_id=str(user_id), message=f"Error uploading image: {str(e)}")
             session.add(log)
             await session.commit()
 
 
+async def media_group_handler(updates: list):
+    """Обрабатывает альбом: фото загружаются параллельно, подпись альбома — один запрос к LLM"""
+    # Подпись альбома Telegram присылает у одного из сообщений, на него же и отвечаем
+    update = next((item for item in updates if item.message.caption), updates[0])
+    user_id = update.effective_user.id
+    upload = album_uploads.pop((update.message.chat_id, update.message.media_group_id), None)
+
+    try:
+        max_edge = await photo_max_edge(str(user_id))
+        photos = [pick_photo_size(item.message.photo, max_edge) for item in updates]
+        user_images = await add_telegram_photos(str(user_id), photos)
+        image_paths = [user_image.image_path for user_image in user_images]
+
+        async with async_session() as session:
+            log = Log(user_id=str(user_id), message=f"Uploaded album of {len(image_paths)} images: {', '.join(image_paths)}")
+            session.add(log)
+            await session.commit()
+
+        image_hash = combine_image_hashes([user_image.image_hash for user_image in user_images])
+        await handle_uploaded_images(update, update.message.caption, image_paths, image_hash)
+    except Exception as e:
+        await update.message.reply_text(f"Произошла ошибка при загрузке изображений: {str(e)}")
+        async with async_session() as session:
+            log = Log(user_id=str(user_id), message=f"Error uploading album: {str(e)}")
+            session.add(log)
+            await session.commit()
+    finally:
+        if upload is not None:
+            end_upload(str(user_id), upload)
+
+
+media_groups = MediaGroupCollector(MEDIA_GROUP_WINDOW, media_group_handler)
+
+
+async def handle_uploaded_images(update: Update, caption: str, image_paths: list, image_hash: str = None):
+    """Отвечает на загруженные изображения: по подписи — запросом к LLM, без неё — запоминает их для следующего вопроса"""
+    user_id = update.effective_user.id
+
+    # Проверяем, есть ли подпись к фотографии
+    if caption:
+        # Если есть подпись, сразу отправляем запрос в LLM
+        # Проверка, включена ли LLM-функциональность глобально и для пользователя (одним запросом с лимитом)
+        precheck = await get_llm_precheck(str(user_id))
+        if not await check_llm_access(update, precheck):
+            return
+
+        await ask_llm(update, precheck, caption, image_paths, image_hash)
+    else:
+        # Если нет подписи, сохраняем изображения для следующего запроса
+        user_last_image[str(user_id)] = image_paths
+        if len(image_paths) == 1:
+            uploaded, about = "Изображение успешно загружено", "о нём, и я отправлю его"
+        else:
+            uploaded, about = f"Изображения ({len(image_paths)}) успешно загружены", "о них, и я отправлю их"
+        
+        # Проверяем, включена ли LLM-функциональность для пользователя
+        async with async_session() as session:
+            user_result = await session.execute(select(User).where(User.tg_id == str(user_id)))
+            user = user_result.scalar_one_or_none()
+            
+            if user and user.llm_enabled:
+                await update.message.reply_text(
+                    f"{uploaded}. Теперь вы можете задать вопрос {about} вместе с вашим запросом в LLM."
+                )
+            else:
+                await update.message.reply_text(
+                    f"{uploaded}. Обратите внимание, что функция LLM отключена для вашего аккаунта."
+                )
+
+
+async def ask_llm(update: Update, precheck: LLMPrecheck, prompt: str, image_paths: list = None, image_hash: str = None):
+    """
+    Выполняет разрешённый запрос к LLM: ответ из кэша, резервирование лимита и ответ модели
+    (сразу или через очередь заданий)
+    """
+    # Получаем модель LLM и вес в очереди для пользователя
+    user_model = precheck.user.llm_model
+    user_weight = precheck.user.llm_weight
+
+    if not LLM_CACHE_HIT_COUNTS_QUOTA:
+        # Ответ из кэша лимит не расходует — отдаём его и исчерпавшему лимит пользователю
+        if image_hash is None and image_paths:
+            image_hash = combine_image_hashes([await get_image_hash(path) for path in image_paths])
+        if await answer_from_cache(update, prompt, resolve_model(user_model), image_hash):
+            return
+
+    if not await reserve_llm_request(update, precheck):
+        return
+
+    if LLM_JOB_QUEUE_ENABLED:
+        # Запрос выполнит процесс worker.py, изображения передаются путями в Minio
+        try:
+            await enqueue_llm_job(update, prompt, user_model=user_model, user_weight=user_weight, **_job_images(image_paths))
+        except BaseException:
+            # Задание не поставлено — ответа не будет
+            await refund_llm_quota(precheck.user.tg_id)
+            raise
+        await update.message.reply_chat_action(ChatAction.TYPING)
+        return
+
+    # Получаем ответ от LLM, сохраняем его и отправляем пользователю
+    await answer_with_llm(
+        update,
+        prompt,
+        user_model=user_model,
+        image_paths=image_paths,
+        user_weight=user_weight,
+        image_hash=image_hash,
+        check_cache=LLM_CACHE_HIT_COUNTS_QUOTA,
+    )
+
+
+def _job_images(image_paths: list) -> dict:
+    # Одно изображение передаётся в image_path, как и раньше, чтобы задание понял и воркер прежней версии
+    if not image_paths:
+        return {}
+    if len(image_paths) == 1:
+        return {"image_path": image_paths[0]}
+    return {"image_paths": image_paths}
+
+
 # Обновленный обработчик для LLM-запросов
 async def llm_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -727,83 +1139,29 @@ async def llm_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     prompt = update.message.text
+    # Фото без подписи, отправленное перед вопросом, может ещё загружаться
+    await wait_for_uploads(str(user_id))
 
-    # Проверка, включена ли LLM-функциональность глобально
-    async with async_session() as session:
-        config_result = await session.execute(select(LLMConfig))
-        config = config_result.scalars().first()
-        if config is None or not config.enabled:
-            await update.message.reply_text("LLM функция временно отключена.")
-            return
-        
-        # Проверка, включена ли LLM-функциональность для конкретного пользователя
-        user_result = await session.execute(select(User).where(User.tg_id == str(user_id)))
-        user = user_result.scalar_one_or_none()
-        if user is None or not user.llm_enabled:
-            await update.message.reply_text("LLM функция отключена для вашего аккаунта.")
-            return
+    # Проверка, включена ли LLM-функциональность глобально и для пользователя (одним запросом с лимитом)
+    precheck = await get_llm_precheck(str(user_id))
+    if not await check_llm_access(update, precheck):
+        return
 
-        # Получаем или создаём запись с лимитом для пользователя
-        result = await session.execute(select(LLMUsage).where(LLMUsage.user_id == str(user_id)))
-        usage = result.scalar_one_or_none()
-        if usage is None:
-            usage = LLMUsage(user_id=str(user_id), used=0, limit=int(os.getenv("DEFAULT_LIMIT_LLM")))
-            session.add(usage)
-            await session.commit()
-        if usage.used >= usage.limit:
-            await update.message.reply_text(
-                f"Вы исчерпали лимит запросов. Для увеличения обратитесь к @{SUPERUSER_TG_NICK}",
-                reply_to_message_id=update.message.message_id,
-            )
-            return
-        
-        # Получаем модель LLM для пользователя
-        user_model = user.llm_model
-    
-    # Проверяем, есть ли у пользователя последнее загруженное изображение
-    image_base64 = None
-    if str(user_id) in user_last_image:
+    # Проверяем, есть ли у пользователя последние загруженные изображения
+    # Изображения забираются из словаря сразу, чтобы параллельный вопрос не использовал их повторно
+    image_paths = user_last_image.pop(str(user_id), None)
+    image_hash = None
+    if image_paths:
         try:
-            image_path = user_last_image[str(user_id)]
-            image_base64 = await image_to_base64(image_path)
-            # Удаляем изображение из словаря, чтобы оно не использовалось повторно
-            del user_last_image[str(user_id)]
+            image_hash = combine_image_hashes([await get_image_hash(image_path) for image_path in image_paths])
         except Exception as e:
+            image_paths = None
             async with async_session() as session:
                 log = Log(user_id=str(user_id), message=f"Error processing image for LLM: {str(e)}")
                 session.add(log)
                 await session.commit()
 
-    # Получаем ответ от LLM
-    try:
-        response_text = await get_llm_response(prompt, model=user_model, image_base64=image_base64)
-    except Exception as e:
-        async with async_session() as session:
-            log = Log(user_id=str(user_id), message=f"Ошибка при обращении к LLM API. User:{user_id}, Error:{e}")
-            session.add(log)
-            await session.commit()
-        await update.message.reply_text(
-            "Ошибка при обращении к LLM API.",
-            reply_to_message_id=update.message.message_id,
-        )
-        return
-
-    # Сохраняем запрос и ответ в БД и увеличиваем счётчик использования
-    async with async_session() as session:
-        llm_req = LLMRequest(user_id=str(user_id), prompt=prompt, response=response_text)
-        session.add(llm_req)
-        # Обновляем лимит
-        result = await session.execute(select(LLMUsage).where(LLMUsage.user_id == str(user_id)))
-        usage = result.scalar_one_or_none()
-        if usage:
-            usage.used += 1
-        await session.commit()
-
-    await update.message.reply_text(
-        response_text,
-        parse_mode="HTML",
-        reply_to_message_id=update.message.message_id,
-    )
+    await ask_llm(update, precheck, prompt, image_paths, image_hash)
 
 
 # Обработчики для суперпользовательских команд
@@ -824,6 +1182,7 @@ async def llm_enable_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
             session.add(config)
         else:
             config.enabled = True
+        await notify_llm_settings_changed(session)
         await session.commit()
     await update.message.reply_text(
         "LLM функция включена.",
@@ -846,6 +1205,7 @@ async def llm_disable_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             session.add(config)
         else:
             config.enabled = False
+        await notify_llm_settings_changed(session)
         await session.commit()
     await update.message.reply_text(
         "LLM функция отключена.",
@@ -1061,42 +1421,215 @@ async def llm_user_disable_handler(update: Update, context: ContextTypes.DEFAULT
     )
 
 
-# Функция для получения информации о пользователе
-async def get_user_info(user_id):
+async def llm_set_weight_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if str(update.effective_user.id) != SUPERUSER_TG_ID:
+        await update.message.reply_text(
+            "У вас нет прав для выполнения этой команды.",
+            reply_to_message_id=update.message.message_id,
+        )
+        return
+    try:
+        target_user = context.args[0]
+        weight = float(context.args[1])
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "Используйте: /llm_set_weight <tg_id или @username> <вес>",
+            reply_to_message_id=update.message.message_id,
+        )
+        return
+    if weight <= 0:
+        await update.message.reply_text(
+            "Вес должен быть больше нуля.",
+            reply_to_message_id=update.message.message_id,
+        )
+        return
+
     async with async_session() as session:
-        # Получаем информацию о пользователе
-        user_result = await session.execute(select(User).where(User.tg_id == user_id))
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            return "Пользователь не найден"
-        
-        display_name = f"{user.full_name}"
-        if user.username:
-            display_name += f" (@{user.username})"
-            
-        llm_status = "включен" if user.llm_enabled else "отключен"
-        model_info = f"Модель: {user.llm_model}" if user.llm_model else "Модель не установлена"
-        
-        # Получаем информацию о лимите
-        usage_result = await session.execute(select(LLMUsage).where(LLMUsage.user_id == user_id))
-        usage = usage_result.scalar_one_or_none()
-        limit_info = ""
-        if usage:
-            limit_info = f"Использовано {usage.used} из {usage.limit} запросов"
+        if target_user.startswith("@"):
+            result = await session.execute(select(User).where(User.username == target_user[1:]))
         else:
-            limit_info = "Лимит не установлен"
-        
-        return (
-            f"Пользователь: {display_name}\n"
-            f"ID: {user.tg_id}\n"
-            f"LLM: {llm_status}\n"
-            f"{model_info}\n"
-            f"{limit_info}"
+            result = await session.execute(select(User).where(User.tg_id == target_user))
+        user = result.scalar_one_or_none()
+        if user is None:
+            await update.message.reply_text(
+                f"Пользователь {target_user} не найден.",
+                reply_to_message_id=update.message.message_id,
+            )
+            return
+        user.llm_weight = weight
+        await session.commit()
+
+    await update.message.reply_text(
+        f"Вес пользователя {target_user} в очереди к LLM установлен на {weight:g}.",
+        reply_to_message_id=update.message.message_id,
+    )
+
+
+async def llm_jobs_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if str(update.effective_user.id) != SUPERUSER_TG_ID:
+        await update.message.reply_text(
+            "У вас нет прав для выполнения этой команды.",
+            reply_to_message_id=update.message.message_id,
+        )
+        return
+
+    stats = await llm_job_stats()
+    mode = "включена" if LLM_JOB_QUEUE_ENABLED else "выключена"
+    await update.message.reply_text(
+        f"Очередь заданий LLM {mode}.\n"
+        f"В очереди: {stats.get('queued', 0)}\n"
+        f"Выполняются: {stats.get('running', 0)}\n"
+        f"Выполнено: {stats.get('done', 0)}\n"
+        f"Dead letter: {stats.get('dead', 0)}",
+        reply_to_message_id=update.message.message_id,
+    )
+
+
+async def db_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if str(update.effective_user.id) != SUPERUSER_TG_ID:
+        await update.message.reply_text(
+            "У вас нет прав для выполнения этой команды.",
+            reply_to_message_id=update.message.message_id,
+        )
+        return
+
+    updates = query_stats["updates"]
+    lines = [
+        f"Статистика SQL по выборке из {updates} обновлений:",
+        f"Запросов на обновление: {query_stats['queries'] / updates:.1f} (макс. {query_stats['max_queries']})" if updates else "Запросов на обновление: нет данных",
+        f"Время SQL на обновление: {query_stats['total_ms'] / updates:.1f} мс" if updates else "Время SQL на обновление: нет данных",
+        f"Медленных запросов: {query_stats['slow_queries']}",
+    ]
+    statements = top_statements()
+    if statements:
+        lines.append("")
+        lines.append("Самые затратные запросы:")
+        for statement, count, total_ms, max_ms in statements:
+            lines.append(f"{total_ms:.0f} мс всего, {count} раз, макс. {max_ms:.0f} мс: {statement[:200]}")
+    await update.message.reply_text("\n".join(lines), reply_to_message_id=update.message.message_id)
+
+
+async def _start_query_sample(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    start_query_sample()
+
+
+async def _finish_query_sample(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    finish_query_sample()
+
+
+def _format_mb(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} МБ"
+
+
+async def image_gc_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if str(update.effective_user.id) != SUPERUSER_TG_ID:
+        await update.message.reply_text(
+            "У вас нет прав для выполнения этой команды.",
+            reply_to_message_id=update.message.message_id,
+        )
+        return
+
+    if context.args and context.args[0] == "run":
+        if image_gc_running():
+            await update.message.reply_text("Сборка мусора изображений уже выполняется.", reply_to_message_id=update.message.message_id)
+            return
+
+        async def run():
+            try:
+                stats = await collect_image_garbage()
+            except Exception as err:
+                print(f"Error collecting image garbage: {err}")
+                await update.message.reply_text("Ошибка при сборке мусора изображений.", reply_to_message_id=update.message.message_id)
+                return
+            await update.message.reply_text(
+                f"Сборка мусора изображений завершена.\n"
+                f"Удалено записей user_images: {stats['images']}\n"
+                f"Удалено blob-ов: {stats['blobs']}\n"
+                f"Удалено объектов Minio: {stats['objects']} (ошибок: {stats['failed']})\n"
+                f"Освобождено: {_format_mb(stats['bytes'])}",
+                reply_to_message_id=update.message.message_id,
+            )
+
+        # Сборка идёт в фоне, чтобы не задерживать обработку других обновлений
+        context.application.create_task(run(), update=update)
+        await update.message.reply_text("Сборка мусора изображений запущена.", reply_to_message_id=update.message.message_id)
+        return
+
+    report = await image_gc_report()
+    retention = f"{IMAGE_RETENTION_DAYS:g} дн." if IMAGE_RETENTION_DAYS > 0 else "бессрочно"
+    await update.message.reply_text(
+        f"Сборка мусора изображений (пробный запуск), срок хранения: {retention}\n"
+        f"Записей user_images к удалению: {report['expired_images']} (старых объектов без blob-а: {report['legacy_objects']})\n"
+        f"Blob-ов без ссылок сейчас: {report['orphan_blobs']} ({_format_mb(report['orphan_bytes'])})\n"
+        f"Blob-ов останется без ссылок: {report['released_blobs']} ({_format_mb(report['released_bytes'])}, удалятся через {IMAGE_GC_GRACE_HOURS:g} ч)\n"
+        f"Незавершённых загрузок: {report['stale_uploads']} ({_format_mb(report['stale_upload_bytes'])})\n"
+        f"Запустить: /image_gc run",
+        reply_to_message_id=update.message.message_id,
+    )
+
+
+async def llm_cache_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if str(update.effective_user.id) != SUPERUSER_TG_ID:
+        await update.message.reply_text(
+            "У вас нет прав для выполнения этой команды.",
+            reply_to_message_id=update.message.message_id,
         )
+        return
+
+    # Семантический поиск выполняется только после промаха точного кэша
+    hits = cache_stats["memory_hits"] + cache_stats["db_hits"] + cache_stats["semantic_hits"]
+    total = cache_stats["memory_hits"] + cache_stats["db_hits"] + cache_stats["misses"]
+    hit_rate = f"{hits / total * 100:.1f}%" if total else "нет данных"
+    await update.message.reply_text(
+        "Кэш ответов LLM:\n"
+        f"Попадания в памяти: {cache_stats['memory_hits']}\n"
+        f"Попадания в БД: {cache_stats['db_hits']}\n"
+        f"Семантические попадания: {cache_stats['semantic_hits']}\n"
+        f"Промахи: {cache_stats['misses']}\n"
+        f"Сохранено ответов: {cache_stats['stores']}\n"
+        f"Удалено просроченных из БД: {cache_stats['purged']}\n"
+        f"Ошибки: {cache_stats['errors']}\n"
+        f"Доля попаданий: {hit_rate}",
+        reply_to_message_id=update.message.message_id,
+    )
+
+
+# Функция для получения информации о пользователе
+async def get_user_info(user_id):
+    # Получаем информацию о пользователе и его лимите одним запросом
+    precheck = await get_llm_precheck(user_id)
+    user = precheck.user
+    
+    if not user:
+        return "Пользователь не найден"
+    
+    display_name = f"{user.full_name}"
+    if user.username:
+        display_name += f" (@{user.username})"
+        
+    llm_status = "включен" if user.llm_enabled else "отключен"
+    model_info = f"Модель: {user.llm_model}" if user.llm_model else "Модель не установлена"
+    
+    usage = precheck.usage
+    if usage:
+        limit_info = f"Использовано {usage.used} из {usage.limit} запросов"
+    else:
+        limit_info = "Лимит не установлен"
+    
+    return (
+        f"Пользователь: {display_name}\n"
+        f"ID: {user.tg_id}\n"
+        f"LLM: {llm_status}\n"
+        f"{model_info}\n"
+        f"Вес в очереди к LLM: {user.llm_weight:g}\n"
+        f"{limit_info}"
+    )
 
 
 def register_handlers(app):
+    # Статистика SQL-запросов собирается вокруг обработки каждого обновления (группы -1 и 1)
+    app.add_handler(TypeHandler(Update, _start_query_sample), group=-1)
+    app.add_handler(TypeHandler(Update, _finish_query_sample), group=1)
     app.add_handler(CommandHandler("start", start_handler))
     app.add_handler(CommandHandler("about", about_handler))
     app.add_handler(CommandHandler("feedback", feedback_command_handler))
@@ -1106,6 +1639,11 @@ def register_handlers(app):
     app.add_handler(CommandHandler("llm_set_model", llm_set_model_handler))
     app.add_handler(CommandHandler("llm_user_enable", llm_user_enable_handler))
     app.add_handler(CommandHandler("llm_user_disable", llm_user_disable_handler))
+    app.add_handler(CommandHandler("llm_set_weight", llm_set_weight_handler))
+    app.add_handler(CommandHandler("llm_cache_stats", llm_cache_stats_handler))
+    app.add_handler(CommandHandler("llm_jobs", llm_jobs_handler))
+    app.add_handler(CommandHandler("image_gc", image_gc_handler))
+    app.add_handler(CommandHandler("db_stats", db_stats_handler))
     app.add_handler(CallbackQueryHandler(category_callback, pattern=r"^category:"))
     app.add_handler(CallbackQueryHandler(back_to_categories_callback, pattern=r"^back_to_categories$"))
     app.add_handler(CallbackQueryHandler(subtopic_callback, pattern=r"^subtopic:"))
@@ -0,0 +1,200 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, exists, func
+from sqlalchemy.future import select
+
+from bot.config import IMAGE_GC_BATCH_SIZE, IMAGE_GC_GRACE_HOURS, IMAGE_GC_INTERVAL, IMAGE_RETENTION_DAYS
+from bot.database import async_session
+from bot.image_store import release_user_images
+from bot.models import ImageBlob, UserImage
+from bot.storage import list_stale_uploads, remove_images
+
+# Сборка мусора изображений: удаляет записи user_images старше IMAGE_RETENTION_DAYS,
+# blob-ы без ссылок старше IMAGE_GC_GRACE_HOURS и временные объекты незавершённых загрузок.
+# Работает пакетами по IMAGE_GC_BATCH_SIZE с паузами, обращения к Minio идут через пул потоков,
+# поэтому обработка обновлений Telegram не останавливается.
+
+# Пауза между пакетами, секунд
+_BATCH_PAUSE = 0.1
+
+_task: asyncio.Task = None
+_lock = asyncio.Lock()
+
+
+def _retention_cutoff() -> datetime:
+    return datetime.utcnow() - timedelta(days=IMAGE_RETENTION_DAYS)
+
+
+def _grace_cutoff() -> datetime:
+    return datetime.utcnow() - timedelta(hours=IMAGE_GC_GRACE_HOURS)
+
+
+def _orphan_blobs():
+    # Blob без ссылок: счётчик обнулён и на него действительно не ссылается ни одна запись
+    return (ImageBlob.ref_count <= 0) & ~exists().where(UserImage.image_hash == ImageBlob.sha256)
+
+
+async def image_gc_report() -> dict:
+    """
+    Оценивает результат сборки мусора без удаления (dry run)
+
+    Returns:
+        Словарь: expired_images — записей user_images старше срока хранения;
+        legacy_objects — из них старых объектов без blob-а (размер неизвестен);
+        released_blobs/released_bytes — blob-ы, которые останутся без ссылок (удаляются после IMAGE_GC_GRACE_HOURS);
+        orphan_blobs/orphan_bytes — blob-ы без ссылок, удаляемые сейчас;
+        stale_uploads/stale_upload_bytes — временные объекты незавершённых загрузок
+    """
+    report = {"expired_images": 0, "legacy_objects": 0, "released_blobs": 0, "released_bytes": 0}
+    async with async_session() as session:
+        if IMAGE_RETENTION_DAYS > 0:
+            cutoff = _retention_cutoff()
+            result = await session.execute(
+                select(func.count(), func.count().filter(UserImage.image_hash.is_(None))).where(UserImage.created_at < cutoff)
+            )
+            report["expired_images"], report["legacy_objects"] = result.one()
+
+            expired = (
+                select(UserImage.image_hash, func.count().label("images"))
+                .where(UserImage.created_at < cutoff, UserImage.image_hash.is_not(None))
+                .group_by(UserImage.image_hash)
+                .subquery()
+            )
+            result = await session.execute(
+                select(func.count(), func.coalesce(func.sum(ImageBlob.size), 0))
+                .join(expired, expired.c.image_hash == ImageBlob.sha256)
+                .where(ImageBlob.ref_count - expired.c.images <= 0)
+            )
+            report["released_blobs"], report["released_bytes"] = result.one()
+
+        result = await session.execute(
+            select(func.count(), func.coalesce(func.sum(ImageBlob.size), 0)).where(
+                _orphan_blobs(), ImageBlob.last_referenced_at < _grace_cutoff()
+            )
+        )
+        report["orphan_blobs"], report["orphan_bytes"] = result.one()
+
+    uploads = await list_stale_uploads(datetime.now(timezone.utc) - timedelta(hours=IMAGE_GC_GRACE_HOURS))
+    report["stale_uploads"] = len(uploads)
+    report["stale_upload_bytes"] = sum(size for _, size in uploads)
+    return report
+
+
+async def _expire_user_images(cutoff: datetime, stats: dict) -> int:
+    # Удаляет пакет записей user_images старше срока хранения и уменьшает счётчики ссылок их blob-ов
+    async with async_session() as session:
+        result = await session.execute(
+            select(UserImage)
+            .where(UserImage.created_at < cutoff)
+            .order_by(UserImage.id)
+            .limit(IMAGE_GC_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        images = result.scalars().all()
+        if not images:
+            return 0
+        await release_user_images(session, images)
+        await session.execute(delete(UserImage).where(UserImage.id.in_([image.id for image in images])))
+
+        # Старые записи без blob-а владеют своим объектом, если на него не ссылаются другие записи
+        legacy = {image.image_path for image in images if image.image_hash is None}
+        if legacy:
+            result = await session.execute(select(UserImage.image_path).where(UserImage.image_path.in_(legacy)))
+            legacy -= set(result.scalars())
+        await session.commit()
+
+    if legacy:
+        stats["failed"] += await remove_images(sorted(legacy))
+        stats["objects"] += len(legacy)
+    stats["images"] += len(images)
+    return len(images)
+
+
+async def _collect_blobs(cutoff: datetime, stats: dict) -> int:
+    # Удаляет пакет blob-ов без ссылок: сначала объекты в Minio, затем строки image_blobs
+    async with async_session() as session:
+        result = await session.execute(
+            select(ImageBlob.sha256, ImageBlob.object_name, ImageBlob.size)
+            .where(_orphan_blobs(), ImageBlob.last_referenced_at < cutoff)
+            .limit(IMAGE_GC_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        blobs = result.all()
+        if not blobs:
+            return 0
+        # Строки заблокированы, пока удаляются объекты: одновременная загрузка того же
+        # изображения дождётся фиксации транзакции и создаст blob заново
+        failed = await remove_images([blob.object_name for blob in blobs])
+        if failed:
+            # Строки остаются, чтобы повторить удаление при следующем запуске
+            await session.rollback()
+            stats["failed"] += failed
+            return 0
+        await session.execute(delete(ImageBlob).where(ImageBlob.sha256.in_([blob.sha256 for blob in blobs])))
+        await session.commit()
+
+    stats["blobs"] += len(blobs)
+    stats["objects"] += len(blobs)
+    stats["bytes"] += sum(blob.size for blob in blobs)
+    return len(blobs)
+
+
+async def collect_image_garbage() -> dict:
+    """
+    Выполняет сборку мусора изображений
+
+    Returns:
+        Словарь: images — удалено записей user_images, blobs — blob-ов, objects — объектов Minio,
+        bytes — освобождено байт (по размерам blob-ов), failed — ошибок удаления объектов
+    """
+    stats = {"images": 0, "blobs": 0, "objects": 0, "bytes": 0, "failed": 0}
+    async with _lock:
+        if IMAGE_RETENTION_DAYS > 0:
+            cutoff = _retention_cutoff()
+            while await _expire_user_images(cutoff, stats) == IMAGE_GC_BATCH_SIZE:
+                await asyncio.sleep(_BATCH_PAUSE)
+
+        cutoff = _grace_cutoff()
+        while await _collect_blobs(cutoff, stats) == IMAGE_GC_BATCH_SIZE:
+            await asyncio.sleep(_BATCH_PAUSE)
+
+        uploads = await list_stale_uploads(datetime.now(timezone.utc) - timedelta(hours=IMAGE_GC_GRACE_HOURS))
+        if uploads:
+            stats["failed"] += await remove_images([name for name, _ in uploads])
+            stats["objects"] += len(uploads)
+            stats["bytes"] += sum(size for _, size in uploads)
+    return stats
+
+
+def image_gc_running() -> bool:
+    return _lock.locked()
+
+
+async def _image_gc_loop():
+    while True:
+        await asyncio.sleep(IMAGE_GC_INTERVAL)
+        try:
+            stats = await collect_image_garbage()
+            print(f"Image GC: {stats}")
+        except Exception as err:
+            print(f"Error collecting image garbage: {err}")
+
+
+def start_image_gc():
+    """Запускает периодическую сборку мусора изображений (вызывается при старте бота)"""
+    global _task
+    if IMAGE_GC_INTERVAL > 0 and _task is None:
+        _task = asyncio.create_task(_image_gc_loop())
+
+
+async def stop_image_gc():
+    """Останавливает периодическую сборку мусора (вызывается при остановке бота)"""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+    _task = None
@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import re
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import literal_column, update
+from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.cache import LRUCache
+from bot.config import IMAGE_NORMALIZE_ENABLED, LLM_IMAGE_URL_TTL
+from bot.database import async_session
+from bot.images import normalize_image
+from bot.llm import get_llm_router, image_data_url
+from bot.llm_settings import get_model_settings
+from bot.models import ImageBlob, UserImage
+from bot.storage import get_image, get_image_url, image_to_base64, public_minio_client, put_image, save_image_stream
+
+# Имя объекта в Minio, адресуемого по содержимому (см. storage.image_object_name)
+_CONTENT_ADDRESSED_PATH = re.compile(r"^sha256/[0-9a-f]{2}/([0-9a-f]{64})\.\w+$")
+
+# Telegram file_unique_id -> SHA-256 сохранённого изображения: повторно присланные
+# и пересланные фотографии не скачиваются из Telegram и не загружаются в Minio
+_telegram_files = LRUCache(10000)
+
+# HTTP-клиент для потокового скачивания файлов Telegram (создаётся при первом использовании)
+_telegram_http: httpx.AsyncClient = None
+
+
+@dataclass
+class StoredImage:
+    """Изображение, уже лежащее в Minio, для которого создаётся запись user_images"""
+    image_hash: str
+    object_name: str
+    content_type: str
+    size: int
+    file_unique_id: str = None
+    reused: bool = False  # Фото Telegram найдено по file_unique_id, без скачивания и загрузки
+    skipped: bool = False  # Объект уже был в Minio, загрузка пропущена
+
+
+async def add_user_images(user_id: str, images: list) -> tuple:
+    """
+    Создаёт blob-ы (или увеличивает их счётчики ссылок) и записи user_images одной транзакцией
+
+    Args:
+        user_id: ID пользователя
+        images: Список StoredImage, объекты которых уже загружены в Minio
+
+    Returns:
+        Кортеж (записи UserImage в порядке images, множество SHA-256 blob-ов, созданных заново)
+    """
+    now = datetime.utcnow()
+    counts = Counter(image.image_hash for image in images)
+    blobs = {image.image_hash: image for image in images}
+    async with async_session() as session:
+        # Одна вставка на все blob-ы; порядок по хешу исключает взаимоблокировки параллельных транзакций
+        statement = insert(ImageBlob).values([
+            {
+                "sha256": image_hash,
+                "object_name": blobs[image_hash].object_name,
+                "content_type": blobs[image_hash].content_type,
+                "size": blobs[image_hash].size,
+                "ref_count": counts[image_hash],
+                "created_at": now,
+                "last_referenced_at": now,
+            }
+            for image_hash in sorted(blobs)
+        ])
+        result = await session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[ImageBlob.sha256],
+                set_={"ref_count": ImageBlob.ref_count + statement.excluded.ref_count, "last_referenced_at": now},
+            ).returning(ImageBlob.sha256, literal_column("xmax = 0").label("inserted"))
+        )
+        # xmax = 0 у строки, которая вставлена, а не обновлена
+        created = {row.sha256 for row in result if row.inserted}
+        user_images = [
+            UserImage(user_id=user_id, image_path=image.object_name, image_hash=image.image_hash, file_unique_id=image.file_unique_id)
+            for image in images
+        ]
+        session.add_all(user_images)
+        await session.commit()
+    for image in images:
+        if image.file_unique_id:
+            _telegram_files.set(image.file_unique_id, image.image_hash)
+    return user_images, created
+
+
+async def add_telegram_photos(user_id: str, photos: list) -> list:
+    """
+    Сохраняет фотографии Telegram (PhotoSize) пользователя
+
+    Фотографии скачиваются, обрабатываются и загружаются в Minio параллельно; уже сохранённые
+    (по file_unique_id) не скачиваются. Записи user_images создаются одной транзакцией.
+
+    Returns:
+        Записи UserImage в порядке photos
+    """
+    stored = await asyncio.gather(*(_store_telegram_photo(photo) for photo in photos))
+    user_images, created = await add_user_images(user_id, stored)
+    # Blob создан заново, а объект не загружали (фото найдено по file_unique_id или объект уже был):
+    # его мог удалить сборщик мусора вместе со старым blob-ом, поэтому фото загружается заново
+    await asyncio.gather(*(
+        _upload_telegram_photo(photo, image.image_hash, force=True)
+        for photo, image in zip(photos, stored)
+        if (image.reused or image.skipped) and image.image_hash in created
+    ))
+    return user_images
+
+
+async def _store_telegram_photo(photo) -> StoredImage:
+    blob = await find_telegram_photo(photo.file_unique_id)
+    if blob is not None:
+        return StoredImage(blob.sha256, blob.object_name, blob.content_type, blob.size, photo.file_unique_id, reused=True)
+    return await _upload_telegram_photo(photo)
+
+
+async def _upload_telegram_photo(photo, image_hash: str = None, force: bool = False) -> StoredImage:
+    # Скачивает фото из Telegram и загружает в Minio (image_hash задаёт имя объекта при повторной загрузке)
+    telegram_file = await photo.get_file()
+    if IMAGE_NORMALIZE_ENABLED:
+        photo_bytes = await telegram_file.download_as_bytearray()
+        # Поворот по EXIF, уменьшение и пережатие (в пуле процессов)
+        image_data, content_type = await normalize_image(photo_bytes)
+        if image_hash is None:
+            image_hash = hashlib.sha256(image_data).hexdigest()
+        image_path, uploaded = await put_image(image_data, content_type, image_hash=image_hash, force=force)
+        return StoredImage(image_hash, image_path, content_type, len(image_data), photo.file_unique_id, skipped=not uploaded)
+    # Без обработки файл передаётся из Telegram в Minio по частям, не целиком в памяти
+    image_path, image_hash, size, uploaded = await save_image_stream(iter_telegram_file(telegram_file), force=force)
+    return StoredImage(image_hash, image_path, "image/jpeg", size, photo.file_unique_id, skipped=not uploaded)
+
+
+async def find_telegram_photo(file_unique_id: str) -> ImageBlob:
+    """Blob уже сохранённой фотографии Telegram по file_unique_id или None"""
+    image_hash = _telegram_files.get(file_unique_id)
+    async with async_session() as session:
+        if image_hash is None:
+            result = await session.execute(
+                select(UserImage.image_hash)
+                .where(UserImage.file_unique_id == file_unique_id, UserImage.image_hash.is_not(None))
+                .limit(1)
+            )
+            image_hash = result.scalar_one_or_none()
+            if image_hash is None:
+                return None
+        blob = await session.get(ImageBlob, image_hash)
+    if blob is None:
+        # Blob удалён сборщиком мусора — фото будет загружено заново
+        _telegram_files.pop(file_unique_id)
+        return None
+    _telegram_files.set(file_unique_id, image_hash)
+    return blob
+
+
+async def iter_telegram_file(telegram_file, chunk_size: int = 64 * 1024):
+    """Скачивает файл Telegram по частям, не собирая его в памяти целиком"""
+    global _telegram_http
+    if _telegram_http is None:
+        _telegram_http = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0))
+    async with _telegram_http.stream("GET", telegram_file.file_path) as response:
+        if response.status_code != 200:
+            # В URL файла содержится токен бота, поэтому в ошибке его нет
+            raise RuntimeError(f"Telegram file download failed with HTTP {response.status_code}")
+        async for chunk in response.aiter_bytes(chunk_size):
+            yield chunk
+
+
+async def close_telegram_http():
+    """Закрывает HTTP-клиент скачивания файлов Telegram (вызывается при остановке бота)"""
+    global _telegram_http
+    if _telegram_http is not None:
+        await _telegram_http.aclose()
+    _telegram_http = None
+
+
+async def release_user_images(session: AsyncSession, images: list):
+    """
+    Уменьшает счётчики ссылок blob-ов перед удалением записей user_images (в транзакции вызывающего)
+
+    Blob с нулевым счётчиком больше никем не используется и может быть удалён сборщиком мусора.
+    """
+    counts = Counter(image.image_hash for image in images if image.image_hash)
+    for image_hash, count in counts.items():
+        await session.execute(
+            update(ImageBlob).where(ImageBlob.sha256 == image_hash).values(ref_count=ImageBlob.ref_count - count)
+        )
+
+
+async def get_image_hash(image_path: str) -> str:
+    """SHA-256 изображения: из имени объекта или, для старых объектов, по содержимому"""
+    match = _CONTENT_ADDRESSED_PATH.match(image_path)
+    if match:
+        return match.group(1)
+    return hashlib.sha256(await get_image(image_path)).hexdigest()
+
+
+def combine_image_hashes(image_hashes: list) -> str:
+    """Хеш набора изображений (для кэша ответов); для одного изображения — его SHA-256"""
+    if len(image_hashes) == 1:
+        return image_hashes[0]
+    return hashlib.sha256("\n".join(image_hashes).encode("utf-8")).hexdigest()
+
+
+async def images_for_llm(model: str, image_paths: list) -> list:
+    """Готовит несколько изображений к передаче в LLM: ссылки или data: URL (см. image_for_llm)"""
+    prepared = await asyncio.gather(*(image_for_llm(model, image_path) for image_path in image_paths))
+    return [image_url or image_data_url(image_base64) for image_url, image_base64 in prepared]
+
+
+async def image_for_llm(model: str, image_path: str) -> tuple:
+    """
+    Готовит изображение к передаче в LLM
+
+    Presigned-ссылка используется, если для модели выбран режим url (llm_models.image_delivery
+    или LLM_IMAGE_DELIVERY), задан MINIO_PUBLIC_URL и все провайдеры модели принимают ссылки.
+    Иначе изображение передаётся в base64.
+
+    Returns:
+        Кортеж (image_url, image_base64), в котором задано ровно одно значение
+    """
+    settings = await get_model_settings(model)
+    if settings.image_delivery == "url" and public_minio_client is not None:
+        router = await get_llm_router()
+        if router.supports_image_urls(model):
+            try:
+                return await get_image_url(image_path, expires=timedelta(seconds=LLM_IMAGE_URL_TTL), public=True), None
+            except Exception as err:
+                print(f"Error creating image URL, falling back to base64: {err}")
+    return None, await image_to_base64(image_path)
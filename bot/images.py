@@ -0,0 +1,100 @@
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+
+from bot.config import IMAGE_FORMAT, IMAGE_MAX_EDGE, IMAGE_NORMALIZE_ENABLED, IMAGE_PROCESS_WORKERS, IMAGE_QUALITY
+
+CONTENT_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Декодирование и сжатие изображений нагружают CPU, поэтому выполняются в отдельных процессах
+_pool = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn вместо fork: процесс бота многопоточный (пул Minio, SQLAlchemy)
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def close_image_pool():
+    """Останавливает пул процессов обработки изображений"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def _normalize(data: bytes, max_edge: int, image_format: str, quality: int) -> bytes:
+    """Поворачивает изображение по EXIF, уменьшает до max_edge по большей стороне и пережимает"""
+    with Image.open(io.BytesIO(data)) as image:
+        # Для JPEG декодер сразу уменьшает изображение в 2^n раз, не распаковывая его целиком
+        ratio = max_edge / max(image.size)
+        if ratio < 1:
+            image.draft("RGB", (int(image.width * ratio), int(image.height * ratio)))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if image_format == "jpeg" and image.mode != "RGB":
+            image = image.convert("RGB")
+        elif image_format == "webp" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        output = io.BytesIO()
+        # EXIF не сохраняется: поворот уже применён, а метаданные (геопозиция и т. п.) не нужны
+        if image_format == "webp":
+            image.save(output, "WEBP", quality=quality, method=4)
+        else:
+            image.save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+        return output.getvalue()
+
+
+async def normalize_image(data: bytes) -> tuple:
+    """
+    Подготавливает изображение к хранению и отправке в LLM
+
+    Args:
+        data: Байты исходного изображения
+
+    Returns:
+        Кортеж (байты, content type). Если обработка отключена или не удалась, возвращается исходное изображение
+    """
+    if not IMAGE_NORMALIZE_ENABLED:
+        return data, "image/jpeg"
+    loop = asyncio.get_running_loop()
+    try:
+        normalized = await loop.run_in_executor(_get_pool(), _normalize, bytes(data), IMAGE_MAX_EDGE, IMAGE_FORMAT, IMAGE_QUALITY)
+        return normalized, CONTENT_TYPES[IMAGE_FORMAT]
+    except BrokenProcessPool as err:
+        # Рабочий процесс упал (например, по памяти) — пул пересоздаётся при следующем вызове
+        print(f"Image process pool is broken: {err}")
+        close_image_pool()
+        return data, "image/jpeg"
+    except Exception as err:
+        print(f"Error normalizing image: {err}")
+        return data, "image/jpeg"
+
+
+def pick_photo_size(photo_sizes: list, max_edge: int = IMAGE_MAX_EDGE):
+    """
+    Выбирает наименьший вариант фотографии Telegram (PhotoSize), у которого большая сторона
+    не меньше max_edge (разрешение модели, см. photo_max_edge в handlers): больший модели не нужен.
+    Если таких нет, возвращает самый большой вариант.
+    """
+    ordered = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if max(size.width, size.height) >= max_edge:
+            return size
+    return ordered[-1]
+
+
+def image_content_type(image_base64: str) -> str:
+    """Определяет content type изображения в base64 по сигнатуре файла"""
+    if image_base64.startswith("UklGR"):  # RIFF....WEBP
+        return "image/webp"
+    if image_base64.startswith("iVBOR"):  # \x89PNG
+        return "image/png"
+    return "image/jpeg"
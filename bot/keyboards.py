@@ -1,7 +1,8 @@
 from telegram import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from sqlalchemy.future import select
 from bot.database import async_session
-from bot.models import Category, Subtopic, User, LLMModel
+from bot.llm_settings import list_models
+from bot.models import Category, Subtopic, User
 
 
 async def get_categories_inline_keyboard():
@@ -97,20 +98,16 @@ def get_user_actions_keyboard():
 
 
 async def get_llm_models_keyboard():
-    # Клавиатура для выбора модели LLM
-    async with async_session() as session:
-        result = await session.execute(select(LLMModel).order_by(LLMModel.name))
-        models = result.scalars().all()
-        
-        keyboard = []
-        for model in models:
-            # Отображаем название модели и её описание
-            keyboard.append([f"{model.name} - {model.description}"])
-        
-        # Добавляем кнопку для ручного ввода новой модели
-        keyboard.append(["Добавить новую модель"])
-        
-        # Добавляем кнопку возврата
-        keyboard.append(["Назад"])
-        
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    # Клавиатура для выбора модели LLM (список моделей берётся из кэша настроек LLM)
+    keyboard = []
+    for model in await list_models():
+        # Отображаем название модели и её описание
+        keyboard.append([f"{model.name} - {model.description}"])
+
+    # Добавляем кнопку для ручного ввода новой модели
+    keyboard.append(["Добавить новую модель"])
+
+    # Добавляем кнопку возврата
+    keyboard.append(["Назад"])
+
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
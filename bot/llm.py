@@ -1,56 +1,435 @@
+import asyncio
+import importlib.util
 import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
 
 import httpx
-import openai
 from dotenv import load_dotenv
 
+from bot.config import (
+    LLM_ATTEMPT_TIMEOUT,
+    LLM_CONNECT_TIMEOUT,
+    LLM_HEDGE_ENABLED,
+    LLM_HTTP2,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_MAX_RETRIES,
+    LLM_POOL_TIMEOUT,
+    LLM_READ_TIMEOUT,
+    LLM_REQUEST_DEADLINE,
+    LLM_RETRY_BASE_DELAY,
+    LLM_RETRY_MAX_DELAY,
+    LLM_STREAM_INCLUDE_USAGE,
+    LLM_WRITE_TIMEOUT,
+)
+from bot.images import image_content_type
+from bot.llm_router import Endpoint, LLMRouter, is_retryable_error, load_endpoints
+from bot.llm_scheduler import Bulkhead, get_bulkhead
+
 load_dotenv()
 
+# Долгоживущие клиенты: создаются при старте бота и переиспользуют соединения (keep-alive).
+# Один HTTP-клиент с пулом соединений общий для всех провайдеров роутера.
+_http_client: httpx.AsyncClient = None
+_router: LLMRouter = None
 
-async def get_llm_response(prompt: str, model: str = None, image_base64: str = None) -> str:
+# Слоты bulkhead, занятые хеджирующими запросами, учитываются отдельно от пользователей
+_HEDGE_FLOW = "__hedge__"
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    """Создаёт HTTP-клиент с пулом соединений и таймаутами по фазам запроса"""
+    http2 = LLM_HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        print("LLM_HTTP2 включен, но пакет h2 не установлен. Используется HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        proxy=os.getenv("PROXY_URL", None),
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=LLM_CONNECT_TIMEOUT,
+            read=LLM_READ_TIMEOUT,
+            write=LLM_WRITE_TIMEOUT,
+            pool=LLM_POOL_TIMEOUT,
+        ),
+    )
+
+
+async def init_llm_client(http_client: httpx.AsyncClient = None):
+    """Инициализация общего LLM-клиента и роутера провайдеров (вызывается при старте бота)"""
+    global _http_client, _router
+    if _router is not None:
+        return
+    _http_client = http_client if http_client is not None else _build_http_client()
+    _router = LLMRouter(load_endpoints(_http_client))
+
+
+async def close_llm_client():
+    """Закрывает общий HTTP-клиент и его пул соединений (вызывается при остановке бота)"""
+    global _http_client, _router
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _router = None
+
+
+async def get_llm_router() -> LLMRouter:
+    """Возвращает роутер провайдеров LLM, создавая его при первом обращении"""
+    if _router is None:
+        await init_llm_client()
+    return _router
+
+
+def resolve_model(model: str = None) -> str:
+    """Возвращает модель пользователя или, если она не указана, модель по умолчанию из .env"""
+    return model if model else os.getenv("LLM_API_MODEL")
+
+
+@dataclass
+class LLMResult:
+    """Результат запроса к LLM вместе с метриками"""
+
+    text: str
+    model: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    first_token_ms: Optional[int] = None  # Время до первого токена (только для стриминга)
+    total_ms: Optional[int] = None
+    endpoint: Optional[str] = None  # Провайдер, который дал ответ
+    source: str = "llm"  # Откуда ответ: llm, cache (кэш ответов) или partial (прерванный стриминг)
+
+
+class LLMStreamInterrupted(Exception):
+    """Стриминг оборвался после того, как пользователь уже увидел часть ответа"""
+
+    def __init__(self, text: str, error: Exception):
+        super().__init__(f"stream interrupted: {type(error).__name__}: {error}")
+        self.text = text  # Уже показанная пользователю часть ответа
+
+
+def image_data_url(image_base64: str) -> str:
+    """data: URL для изображения в base64"""
+    return f"data:{image_content_type(image_base64)};base64,{image_base64}"
+
+
+def build_messages(prompt: str, image_base64: str = None, image_url: str = None, images: list = None) -> list:
     """
-    Получает ответ от LLM модели
-    
+    Формирует список сообщений для chat completions API
+
+    Изображение передаётся ссылкой (image_url) или в base64; images — несколько изображений
+    (ссылки или data: URL) в одном запросе, например альбом.
+    """
+    urls = list(images or [])
+    if image_url or image_base64:
+        urls.insert(0, image_url or image_data_url(image_base64))
+    # Если есть изображения, добавляем их в запрос
+    if urls:
+        return [{
+            "role": "user",
+            "content": [{"type": "text", "text": prompt}] + [
+                {"type": "image_url", "image_url": {"url": url, "detail": "auto"}} for url in urls
+            ]
+        }]
+    return [{"role": "user", "content": prompt}]
+
+
+async def _complete_on(
+    endpoint: Endpoint,
+    llm_model: str,
+    messages: list,
+    on_delta: Callable[[str], Awaitable[None]] = None,
+) -> LLMResult:
+    """Выполняет запрос к конкретному провайдеру"""
+    client = endpoint.client
+    upstream_model = endpoint.upstream_model(llm_model)
+    started = time.monotonic()
+
+    if on_delta is None:
+        response = await client.chat.completions.create(
+            model=upstream_model,
+            messages=messages,
+        )
+        usage = response.usage
+        return LLMResult(
+            text=response.choices[0].message.content,
+            model=llm_model,
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None,
+            total_ms=int((time.monotonic() - started) * 1000),
+            endpoint=endpoint.name,
+        )
+
+    extra = {"stream_options": {"include_usage": True}} if LLM_STREAM_INCLUDE_USAGE else {}
+    stream = await client.chat.completions.create(
+        model=upstream_model,
+        messages=messages,
+        stream=True,
+        **extra,
+    )
+
+    parts = []
+    first_token_ms = None
+    prompt_tokens = completion_tokens = None
+    async for chunk in stream:
+        # Последний чанк с include_usage не содержит choices, только usage
+        if chunk.usage:
+            prompt_tokens = chunk.usage.prompt_tokens
+            completion_tokens = chunk.usage.completion_tokens
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if first_token_ms is None:
+            first_token_ms = int((time.monotonic() - started) * 1000)
+        parts.append(delta)
+        await on_delta("".join(parts))
+
+    return LLMResult(
+        text="".join(parts),
+        model=llm_model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        first_token_ms=first_token_ms,
+        total_ms=int((time.monotonic() - started) * 1000),
+        endpoint=endpoint.name,
+    )
+
+
+async def _attempt(router: LLMRouter, endpoint: Endpoint, llm_model: str, messages: list, on_delta=None) -> LLMResult:
+    """Одна попытка запроса к провайдеру с учётом её результата в статистике роутера"""
+    try:
+        result = await _complete_on(endpoint, llm_model, messages, on_delta)
+    except asyncio.CancelledError:
+        raise
+    except Exception as err:
+        if is_retryable_error(err):
+            router.record_failure(endpoint)
+        raise
+    router.record_success(endpoint, total_ms=result.total_ms, first_token_ms=result.first_token_ms)
+    return result
+
+
+async def _hedged_call(
+    router: LLMRouter,
+    endpoint: Endpoint,
+    hedge_endpoint: Endpoint,
+    llm_model: str,
+    messages: list,
+    on_delta: Callable[[str], Awaitable[None]] = None,
+    bulkhead: Bulkhead = None,
+) -> LLMResult:
+    """
+    Запрос с хеджированием: если основной запрос не ответил (для стриминга — не выдал
+    первый токен) за время hedge_delay, отправляется дублирующий запрос. Побеждает тот,
+    кто первым ответил (выдал первый токен); проигравший отменяется. Если проиграл основной
+    запрос, его время до отмены учитывается как нижняя оценка задержки провайдера.
+
+    Дублирующий запрос занимает отдельный слот bulkhead модели и отправляется, только если
+    слот свободен, — иначе хеджирование удвоило бы число одновременных запросов к провайдеру.
+    """
+    tasks = []
+    winner = None
+    streaming = on_delta is not None
+    started = time.monotonic()
+
+    def finish_race(index: int):
+        nonlocal winner
+        winner = index
+        if index != 0 and not tasks[0].done():
+            # Иначе медленный провайдер без замеров так и остался бы первым в очереди роутера
+            router.record_slow(endpoint, (time.monotonic() - started) * 1000, streaming)
+        for other, task in enumerate(tasks):
+            if other != index:
+                task.cancel()
+
+    def make_delta(index: int):
+        async def delta(text: str):
+            if winner is None:
+                finish_race(index)
+            if winner == index:
+                await on_delta(text)
+        return delta
+
+    def start(target: Endpoint) -> asyncio.Task:
+        index = len(tasks)
+        delta = make_delta(index) if on_delta is not None else None
+        task = asyncio.create_task(_attempt(router, target, llm_model, messages, delta))
+        tasks.append(task)
+        return task
+
+    try:
+        start(endpoint)
+        if hedge_endpoint is not None:
+            done, _ = await asyncio.wait(tasks, timeout=router.hedge_delay(streaming))
+            if not done and winner is None:
+                if bulkhead is not None and not bulkhead.try_acquire(_HEDGE_FLOW):
+                    print(f"LLM endpoint '{endpoint.name}' is slow, but no free slot to hedge")
+                else:
+                    print(f"LLM endpoint '{endpoint.name}' is slow, hedging to '{hedge_endpoint.name}'")
+                    hedge = start(hedge_endpoint)
+                    if bulkhead is not None:
+                        # Слот освобождается, когда задача завершена или отменена (даже до старта)
+                        hedge.add_done_callback(lambda _: bulkhead.release(_HEDGE_FLOW))
+
+        errors = []
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is None:
+                    if winner is None:
+                        finish_race(tasks.index(task))
+                    return task.result()
+                errors.append(task.exception())
+        if errors:
+            raise errors[0]
+        raise asyncio.CancelledError()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _until_first_token(call: asyncio.Task, first_token: asyncio.Event, timeout: float) -> LLMResult:
+    """
+    Ждёт результат запроса, ограничивая таймаутом только время до первого токена:
+    после него стриминг дочитывается до конца (действует таймаут чтения HTTP-клиента)
+    """
+    waiter = asyncio.create_task(first_token.wait())
+    try:
+        await asyncio.wait({call, waiter}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not call.done() and not first_token.is_set():
+            raise asyncio.TimeoutError()
+        return await call
+    finally:
+        waiter.cancel()
+        if not call.done():
+            call.cancel()
+
+
+async def get_llm_completion(
+    prompt: str,
+    model: str = None,
+    image_base64: str = None,
+    on_delta: Callable[[str], Awaitable[None]] = None,
+    image_url: str = None,
+    images: list = None,
+) -> LLMResult:
+    """
+    Получает ответ от LLM модели вместе с количеством токенов и таймингами
+
+    Провайдер выбирается роутером. Бюджет LLM_REQUEST_DEADLINE ограничивает время до ответа
+    (для стриминга — до первого токена) вместе с повторами, одна попытка — LLM_ATTEMPT_TIMEOUT;
+    при таймауте попытки, сетевой ошибке,
+    5xx или 429 выполняются повторы с экспоненциальной задержкой и джиттером, каждый раз
+    на следующем провайдере. Начавшийся стриминг дочитывается без общего дедлайна (действует
+    таймаут чтения); если он оборвался, выбрасывается LLMStreamInterrupted с уже показанным
+    текстом. Медленные запросы хеджируются (при единственном провайдере — на него же).
+
     Args:
         prompt: Текст запроса
         model: Модель LLM (опционально)
         image_base64: Изображение в формате base64 (опционально)
-        
+        on_delta: Корутина, получающая накопленный текст по мере генерации.
+            Если передана, запрос выполняется в режиме stream=True
+        image_url: Ссылка на изображение вместо base64 (опционально)
+        images: Несколько изображений (ссылки или data: URL), например альбом (опционально)
+
     Returns:
-        Ответ от LLM модели
+        LLMResult с текстом ответа и метриками
     """
-    async with httpx.AsyncClient(proxy=os.getenv("PROXY_URL", None)) as http_client:
-        client = openai.AsyncOpenAI(
-            base_url=os.getenv("LLM_API_BASE_URL"), api_key=os.getenv("LLM_API_KEY"), http_client=http_client
-        )
+    router = await get_llm_router()
+    llm_model = resolve_model(model)
+    messages = build_messages(prompt, image_base64, image_url, images)
 
-        # Если модель не указана, используем модель по умолчанию из .env
-        llm_model = model if model else os.getenv("LLM_API_MODEL")
-        
-        # Подготовка сообщений
-        messages = []
-        
-        # Если есть изображение, добавляем его в запрос
-        if image_base64:
-            messages.append({
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}",
-                            "detail": "auto"
-                        }
-                    }
-                ]
-            })
-        else:
-            messages.append({"role": "user", "content": prompt})
+    candidates = router.candidates(llm_model, streaming=on_delta is not None)
+    if not candidates:
+        raise ValueError(f"No LLM endpoint serves model '{llm_model}'")
+    # Если провайдер один, дублирующий запрос уходит на него же (другое соединение, возможно другой бэкенд)
+    hedging = LLM_HEDGE_ENABLED
+    bulkhead = await get_bulkhead(llm_model) if hedging else None
 
-        response = await client.chat.completions.create(
-            model=llm_model,
-            messages=messages,
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LLM_REQUEST_DEADLINE
+    first_token = asyncio.Event()
+    shown = ""
+    last_error = None
+
+    async def track_delta(text: str):
+        nonlocal shown
+        shown = text
+        first_token.set()
+        await on_delta(text)
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        endpoint = candidates[attempt % len(candidates)]
+        hedge_endpoint = candidates[(attempt + 1) % len(candidates)] if hedging else None
+        call = asyncio.create_task(
+            _hedged_call(
+                router,
+                endpoint,
+                hedge_endpoint,
+                llm_model,
+                messages,
+                track_delta if on_delta is not None else None,
+                bulkhead,
+            )
         )
+        # У каждой попытки свой таймаут, чтобы зависший запрос не съел весь бюджет и повторы состоялись
+        remaining = max(deadline - loop.time(), 0)
+        timeout = remaining if attempt == LLM_MAX_RETRIES else min(LLM_ATTEMPT_TIMEOUT, remaining)
+        try:
+            return await _until_first_token(call, first_token, timeout)
+        except asyncio.TimeoutError:
+            if first_token.is_set():
+                # Таймаут чтения уже начавшегося стриминга
+                raise LLMStreamInterrupted(shown, asyncio.TimeoutError())
+            router.record_failure(endpoint)
+            if timeout >= remaining:
+                raise asyncio.TimeoutError(f"LLM request deadline of {LLM_REQUEST_DEADLINE}s exceeded")
+            last_error = asyncio.TimeoutError(f"LLM attempt timed out after {timeout:.1f}s")
+        except Exception as err:
+            if first_token.is_set():
+                # Пользователь уже видит часть ответа: повтор начал бы его заново
+                raise LLMStreamInterrupted(shown, err) from err
+            if not is_retryable_error(err):
+                raise
+            last_error = err
+
+        # Экспоненциальная задержка с полным джиттером, если она укладывается в бюджет
+        backoff = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+        if attempt == LLM_MAX_RETRIES or loop.time() + backoff >= deadline:
+            break
+        print(f"LLM request failed ({type(last_error).__name__}), retry {attempt + 1} in {backoff:.2f}s")
+        await asyncio.sleep(backoff)
+
+    raise last_error
+
+
+async def get_llm_response(prompt: str, model: str = None, image_base64: str = None) -> str:
+    """
+    Получает ответ от LLM модели
+
+    Args:
+        prompt: Текст запроса
+        model: Модель LLM (опционально)
+        image_base64: Изображение в формате base64 (опционально)
 
-        return response.choices[0].message.content
+    Returns:
+        Ответ от LLM модели
+    """
+    result = await get_llm_completion(prompt, model=model, image_base64=image_base64)
+    return result.text
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+
+from bot.cache import LRUCache
+from bot.config import LLM_CACHE_DB_TTL, LLM_CACHE_ENABLED, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_PURGE_INTERVAL, LLM_CACHE_TTL
+from bot.database import async_session
+from bot.llm_settings import get_model_settings
+from bot.models import LLMResponseCache
+
+# Первый уровень кэша — память процесса, второй — таблица llm_response_cache в Postgres
+_memory_cache = LRUCache(LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL)
+
+# Счётчики попаданий/промахов (сбрасываются при перезапуске)
+cache_stats = {"memory_hits": 0, "db_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "errors": 0, "purged": 0}
+
+# Просроченные записи llm_response_cache удаляются пакетами не чаще раза в LLM_CACHE_PURGE_INTERVAL
+_PURGE_BATCH_SIZE = 1000
+_PURGE_BATCH_PAUSE = 0.1  # секунд
+_next_purge_at = 0.0
+_purge_task: asyncio.Task = None
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Нормализует запрос: схлопывает пробелы и приводит к нижнему регистру"""
+    return " ".join(prompt.split()).casefold()
+
+
+def make_cache_key(model: str, prompt: str, image_hash: str = None) -> str:
+    """Ключ кэша: модель + нормализованный запрос + хэш изображения"""
+    raw = f"{model}\n{normalize_prompt(prompt)}\n{image_hash or ''}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def is_cacheable_model(model: str) -> bool:
+    """Проверяет, разрешено ли кэширование для модели (LLMModel.cache_enabled)"""
+    settings = await get_model_settings(model)
+    return settings.cache_enabled
+
+
+async def get_cached_response(model: str, prompt: str, image_hash: str = None) -> str:
+    """
+    Ищет готовый ответ в кэше
+
+    Args:
+        model: Модель LLM
+        prompt: Текст запроса
+        image_hash: Хэш изображения (опционально)
+
+    Returns:
+        Текст ответа или None, если в кэше ничего нет
+    """
+    if not LLM_CACHE_ENABLED or not await is_cacheable_model(model):
+        return None
+
+    key = make_cache_key(model, prompt, image_hash)
+    response = _memory_cache.get(key)
+    if response is not None:
+        cache_stats["memory_hits"] += 1
+        return response
+
+    try:
+        async with async_session() as session:
+            result = await session.execute(
+                select(LLMResponseCache.response).where(
+                    LLMResponseCache.key == key,
+                    LLMResponseCache.expires_at > datetime.utcnow(),
+                )
+            )
+            response = result.scalar_one_or_none()
+    except Exception as err:
+        cache_stats["errors"] += 1
+        print(f"Error reading LLM cache: {err}")
+        response = None
+
+    if response is None:
+        cache_stats["misses"] += 1
+        return None
+
+    cache_stats["db_hits"] += 1
+    _memory_cache.set(key, response)
+    return response
+
+
+async def store_cached_response(model: str, prompt: str, response: str, image_hash: str = None):
+    """Сохраняет ответ в оба уровня кэша"""
+    if not LLM_CACHE_ENABLED or not response or not await is_cacheable_model(model):
+        return
+
+    key = make_cache_key(model, prompt, image_hash)
+    _memory_cache.set(key, response)
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=LLM_CACHE_DB_TTL)
+    try:
+        async with async_session() as session:
+            stmt = insert(LLMResponseCache).values(
+                key=key, model=model, response=response, created_at=now, expires_at=expires_at
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[LLMResponseCache.key],
+                set_={"response": response, "created_at": now, "expires_at": expires_at},
+            )
+            await session.execute(stmt)
+            await session.commit()
+        cache_stats["stores"] += 1
+    except Exception as err:
+        cache_stats["errors"] += 1
+        print(f"Error writing LLM cache: {err}")
+    _schedule_purge()
+
+
+def _schedule_purge():
+    # Очистка запускается записью в кэш: без записей таблица и не растёт
+    global _next_purge_at, _purge_task
+    if LLM_CACHE_PURGE_INTERVAL <= 0 or time.monotonic() < _next_purge_at:
+        return
+    if _purge_task is not None and not _purge_task.done():
+        return
+    _next_purge_at = time.monotonic() + LLM_CACHE_PURGE_INTERVAL
+    _purge_task = asyncio.create_task(purge_expired_responses())
+
+
+async def purge_expired_responses() -> int:
+    """
+    Удаляет просроченные записи llm_response_cache пакетами по _PURGE_BATCH_SIZE
+
+    Returns:
+        Число удалённых записей
+    """
+    purged = 0
+    try:
+        while True:
+            async with async_session() as session:
+                expired = (
+                    select(LLMResponseCache.key)
+                    .where(LLMResponseCache.expires_at < datetime.utcnow())
+                    .limit(_PURGE_BATCH_SIZE)
+                    .with_for_update(skip_locked=True)
+                )
+                result = await session.execute(delete(LLMResponseCache).where(LLMResponseCache.key.in_(expired)))
+                await session.commit()
+            purged += result.rowcount
+            if result.rowcount < _PURGE_BATCH_SIZE:
+                break
+            await asyncio.sleep(_PURGE_BATCH_PAUSE)
+    except Exception as err:
+        cache_stats["errors"] += 1
+        print(f"Error purging LLM cache: {err}")
+    cache_stats["purged"] += purged
+    return purged
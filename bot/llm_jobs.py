@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.future import select
+from telegram import Update
+
+from bot.config import LLM_JOB_MAX_ATTEMPTS, LLM_JOB_RETRY_DELAY, LLM_JOB_VISIBILITY_TIMEOUT
+from bot.database import async_session
+from bot.models import LLMJob
+
+
+async def enqueue_llm_job(update: Update, prompt: str, user_model: str = None, image_path: str = None, user_weight: float = 1.0, image_paths: list = None) -> int:
+    """
+    Ставит запрос к LLM в очередь заданий
+
+    Args:
+        update: Исходный Telegram Update (воркер восстанавливает по нему сообщение для ответа)
+        prompt: Текст запроса
+        user_model: Модель пользователя
+        image_path: Путь к изображению в Minio
+        user_weight: Вес пользователя в справедливой очереди к модели
+        image_paths: Пути к нескольким изображениям (альбом)
+
+    Returns:
+        ID задания
+    """
+    async with async_session() as session:
+        job = LLMJob(
+            user_id=str(update.effective_user.id),
+            update_data=update.to_dict(),
+            prompt=prompt,
+            model=user_model,
+            image_path=image_path,
+            image_paths=image_paths,
+            user_weight=user_weight,
+            max_attempts=LLM_JOB_MAX_ATTEMPTS,
+        )
+        session.add(job)
+        await session.commit()
+        return job.id
+
+
+async def claim_llm_job(worker_id: str) -> LLMJob:
+    """
+    Забирает одно задание: свободное или то, чей воркер не продлил видимость (упал или завис)
+
+    Строка блокируется через FOR UPDATE SKIP LOCKED, поэтому параллельные воркеры
+    не ждут друг друга и не получают одно и то же задание.
+
+    Returns:
+        Задание или None, если очередь пуста
+    """
+    now = datetime.utcnow()
+    candidate = (
+        select(LLMJob.id)
+        .where(
+            or_(
+                and_(LLMJob.status == "queued", LLMJob.available_at <= now),
+                and_(LLMJob.status == "running", LLMJob.locked_until < now),
+            )
+        )
+        .order_by(LLMJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    async with async_session() as session:
+        result = await session.execute(
+            update(LLMJob)
+            .where(LLMJob.id == candidate)
+            .values(
+                status="running",
+                attempts=LLMJob.attempts + 1,
+                locked_until=now + timedelta(seconds=LLM_JOB_VISIBILITY_TIMEOUT),
+                worker_id=worker_id,
+            )
+            .returning(LLMJob)
+            .execution_options(synchronize_session=False)
+        )
+        job = result.scalar_one_or_none()
+        await session.commit()
+        return job
+
+
+async def extend_llm_job(job: LLMJob) -> bool:
+    """Продлевает видимость задания, пока воркер над ним работает; False — задание уже забрал другой воркер"""
+    async with async_session() as session:
+        result = await session.execute(
+            update(LLMJob)
+            .where(LLMJob.id == job.id, LLMJob.worker_id == job.worker_id, LLMJob.status == "running")
+            .values(locked_until=datetime.utcnow() + timedelta(seconds=LLM_JOB_VISIBILITY_TIMEOUT))
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        return result.rowcount > 0
+
+
+async def complete_llm_job(job: LLMJob):
+    async with async_session() as session:
+        await session.execute(
+            update(LLMJob)
+            .where(LLMJob.id == job.id, LLMJob.worker_id == job.worker_id)
+            .values(status="done", locked_until=None, finished_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+
+async def fail_llm_job(job: LLMJob, error: str, retry: bool = True) -> bool:
+    """
+    Возвращает задание в очередь с экспоненциальной задержкой или, если попытки исчерпаны, в dead letter
+
+    Returns:
+        True, если задание будет повторено
+    """
+    retry = retry and job.attempts < job.max_attempts
+    values = {"last_error": error[:2000], "locked_until": None}
+    if retry:
+        delay = LLM_JOB_RETRY_DELAY * 2 ** max(job.attempts - 1, 0)
+        values.update(status="queued", available_at=datetime.utcnow() + timedelta(seconds=delay))
+    else:
+        values.update(status="dead", finished_at=datetime.utcnow())
+    async with async_session() as session:
+        await session.execute(
+            update(LLMJob)
+            .where(LLMJob.id == job.id, LLMJob.worker_id == job.worker_id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+    return retry
+
+
+async def llm_job_stats() -> dict:
+    """Число заданий по статусам"""
+    async with async_session() as session:
+        result = await session.execute(select(LLMJob.status, func.count()).group_by(LLMJob.status))
+        return dict(result.all())
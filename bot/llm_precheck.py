@@ -0,0 +1,39 @@
+from dataclasses import dataclass
+
+from sqlalchemy.future import select
+
+from bot.database import async_session
+from bot.llm_settings import is_llm_enabled
+from bot.models import LLMUsage, User
+
+
+@dataclass
+class LLMPrecheck:
+    """Всё, что нужно проверить перед запросом к LLM: глобальный флаг, пользователь и его лимит"""
+    global_enabled: bool
+    user: User = None
+    usage: LLMUsage = None
+
+
+async def get_llm_precheck(user_id: str) -> LLMPrecheck:
+    """
+    Получает глобальный флаг LLM (из кэша настроек), пользователя и его лимит одним запросом
+
+    Args:
+        user_id: Telegram ID пользователя
+
+    Returns:
+        LLMPrecheck; user и usage равны None, если записей нет
+    """
+    global_enabled = await is_llm_enabled()
+    async with async_session() as session:
+        result = await session.execute(
+            select(User, LLMUsage)
+            .outerjoin(LLMUsage, LLMUsage.user_id == User.tg_id)
+            .where(User.tg_id == user_id)
+        )
+        row = result.one_or_none()
+    if row is None:
+        return LLMPrecheck(global_enabled=global_enabled)
+    user, usage = row
+    return LLMPrecheck(global_enabled=global_enabled, user=user, usage=usage)
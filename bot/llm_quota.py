@@ -0,0 +1,49 @@
+import os
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+
+from bot.database import async_session
+from bot.models import LLMUsage
+
+# Лимит запросов к LLM резервируется одним атомарным запросом до обращения к модели
+# и возвращается, если пользователь так и не получил ответ. Одновременные запросы
+# одного пользователя не могут превысить llm_usage.limit.
+
+
+async def reserve_llm_quota(user_id: str) -> bool:
+    """
+    Резервирует один запрос из лимита пользователя
+
+    Если у пользователя ещё нет записи с лимитом, она создаётся с лимитом DEFAULT_LIMIT_LLM.
+
+    Args:
+        user_id: Telegram ID пользователя
+
+    Returns:
+        True, если запрос зарезервирован; False, если лимит исчерпан
+    """
+    default_limit = int(os.getenv("DEFAULT_LIMIT_LLM"))
+    statement = insert(LLMUsage).values(user_id=user_id, used=1 if default_limit > 0 else 0, limit=default_limit)
+    statement = statement.on_conflict_do_update(
+        index_elements=[LLMUsage.user_id],
+        set_={"used": LLMUsage.used + 1},
+        where=LLMUsage.used < LLMUsage.limit,
+    ).returning(LLMUsage.used, LLMUsage.limit)
+    async with async_session() as session:
+        row = (await session.execute(statement)).one_or_none()
+        await session.commit()
+    # Строки нет — лимит исчерпан; used == 0 — запись только что создана с нулевым лимитом
+    return row is not None and 0 < row.used <= row.limit
+
+
+async def refund_llm_quota(user_id: str):
+    """Возвращает зарезервированный запрос, если ответ не был получен"""
+    async with async_session() as session:
+        await session.execute(
+            update(LLMUsage)
+            .where(LLMUsage.user_id == user_id)
+            .values(used=func.greatest(LLMUsage.used - 1, 0))
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
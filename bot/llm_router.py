@@ -0,0 +1,219 @@
+import json
+import os
+import random
+import time
+from collections import deque
+
+import httpx
+import openai
+
+from bot.config import (
+    LLM_ENDPOINT_EJECT_FAILURES,
+    LLM_ENDPOINT_EJECT_SECONDS,
+    LLM_ENDPOINTS,
+    LLM_HEDGE_DELAY,
+    LLM_HEDGE_INITIAL_DELAY,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEDGE_PERCENTILE,
+    LLM_ROUTER_EWMA_ALPHA,
+    LLM_ROUTER_EXPLORE,
+)
+
+_ERROR_PENALTY_MS = 10000.0
+_HEDGE_MIN_SAMPLES = 20  # Сколько замеров нужно, чтобы доверять перцентилю
+
+
+class Endpoint:
+    """
+    OpenAI-совместимый провайдер со своим ключом, соответствием моделей и статистикой здоровья.
+
+    models — словарь "модель бота" -> "модель провайдера"; None означает, что провайдер
+    обслуживает любые модели под теми же именами. image_urls — умеет ли провайдер сам
+    скачивать изображения по ссылке (иначе изображения передаются только в base64).
+    """
+
+    def __init__(self, name: str, base_url: str, api_key: str, http_client: httpx.AsyncClient, models: dict = None, image_urls: bool = True):
+        self.name = name
+        self.base_url = base_url
+        self.models = models
+        self.image_urls = image_urls
+        # Повторы делает роутер (переключением на другой провайдер), а не SDK
+        self.client = openai.AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0)
+        self.ewma_latency_ms = None  # Полный ответ (запросы без стриминга)
+        self.ewma_first_token_ms = None  # Время до первого токена (стриминг)
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def supports(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def upstream_model(self, model: str) -> str:
+        if self.models is None:
+            return model
+        return self.models[model] or model
+
+    def is_ejected(self, now: float = None) -> bool:
+        return self.ejected_until > (now if now is not None else time.monotonic())
+
+    def latency(self, streaming: bool = False):
+        """EWMA задержки нужного вида (для стриминга — до первого токена) или None, если замеров нет"""
+        return self.ewma_first_token_ms if streaming else self.ewma_latency_ms
+
+    def score(self, streaming: bool = False, default_ms: float = 0.0) -> float:
+        """
+        Чем меньше, тем лучше: EWMA задержки с поправкой на долю ошибок
+
+        Провайдер без замеров получает задержку default_ms (медиану остальных), а не 0 —
+        иначе ни разу не ответивший провайдер навсегда оставался бы первым.
+        """
+        latency = self.latency(streaming)
+        if latency is None:
+            latency = default_ms
+        # Аддитивный штраф нужен и для провайдеров без замеров задержки (все попытки — ошибки)
+        return latency * (1.0 + 4.0 * self.error_rate) + _ERROR_PENALTY_MS * self.error_rate
+
+    def __repr__(self):
+        return (
+            f"<Endpoint(name='{self.name}', latency={self.ewma_latency_ms}, "
+            f"first_token={self.ewma_first_token_ms}, errors={self.error_rate:.2f})>"
+        )
+
+
+class LLMRouter:
+    """Выбор провайдера по EWMA задержки и доле ошибок с временным исключением нездоровых провайдеров"""
+
+    def __init__(self, endpoints: list, alpha: float = LLM_ROUTER_EWMA_ALPHA):
+        if not endpoints:
+            raise ValueError("LLM router requires at least one endpoint")
+        self.endpoints = endpoints
+        self.alpha = alpha
+        # Последние задержки в мс отдельно для полного ответа и для первого токена стриминга:
+        # у них разный масштаб, и перцентиль по смеси дал бы неверную задержку хеджирования
+        self._recent_latencies = deque(maxlen=200)
+        self._recent_first_token = deque(maxlen=200)
+
+    def candidates(self, model: str, streaming: bool = False) -> list:
+        """
+        Возвращает провайдеров, обслуживающих модель, в порядке попыток
+
+        Здоровые провайдеры идут первыми по возрастанию score; исключённые — в конце,
+        чтобы при отказе всех провайдеров запрос всё равно был отправлен.
+        """
+        now = time.monotonic()
+        supported = [ep for ep in self.endpoints if ep.supports(model)]
+        measured = sorted(ep.latency(streaming) for ep in supported if ep.latency(streaming) is not None)
+        default_ms = measured[len(measured) // 2] if measured else 0.0
+        healthy = sorted((ep for ep in supported if not ep.is_ejected(now)), key=lambda ep: ep.score(streaming, default_ms))
+        ejected = sorted((ep for ep in supported if ep.is_ejected(now)), key=lambda ep: ep.ejected_until)
+        # Изредка пробуем не лучший провайдер, чтобы его статистика не устаревала
+        if len(healthy) > 1 and random.random() < LLM_ROUTER_EXPLORE:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        return healthy + ejected
+
+    def supports_image_urls(self, model: str) -> bool:
+        """Все ли провайдеры модели принимают изображения по ссылке (запрос может уйти на любой из них)"""
+        return all(ep.image_urls for ep in self.endpoints if ep.supports(model))
+
+    def record_success(self, endpoint: Endpoint, total_ms: float = None, first_token_ms: float = None):
+        """Учитывает успешный ответ: полный (без стриминга) — total_ms, стриминг — first_token_ms"""
+        if first_token_ms is not None:
+            endpoint.ewma_first_token_ms = self._ewma(endpoint.ewma_first_token_ms, first_token_ms)
+            self._recent_first_token.append(first_token_ms)
+        elif total_ms is not None:
+            endpoint.ewma_latency_ms = self._ewma(endpoint.ewma_latency_ms, total_ms)
+            self._recent_latencies.append(total_ms)
+        endpoint.error_rate = (1 - self.alpha) * endpoint.error_rate
+        endpoint.consecutive_failures = 0
+        endpoint.ejected_until = 0.0
+
+    def record_slow(self, endpoint: Endpoint, elapsed_ms: float, streaming: bool = False):
+        """
+        Учитывает запрос, отменённый после победы хеджирующего: его задержка не меньше elapsed_ms.
+        Замер попадает только в EWMA провайдера (не в перцентиль задержки хеджирования)
+        """
+        if streaming:
+            endpoint.ewma_first_token_ms = self._ewma(endpoint.ewma_first_token_ms, elapsed_ms)
+        else:
+            endpoint.ewma_latency_ms = self._ewma(endpoint.ewma_latency_ms, elapsed_ms)
+
+    def _ewma(self, current: float, sample: float) -> float:
+        if current is None:
+            return sample
+        return (1 - self.alpha) * current + self.alpha * sample
+
+    def record_failure(self, endpoint: Endpoint):
+        endpoint.error_rate = (1 - self.alpha) * endpoint.error_rate + self.alpha
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= LLM_ENDPOINT_EJECT_FAILURES:
+            endpoint.ejected_until = time.monotonic() + LLM_ENDPOINT_EJECT_SECONDS
+            print(f"LLM endpoint '{endpoint.name}' ejected for {LLM_ENDPOINT_EJECT_SECONDS}s")
+
+    def hedge_delay(self, streaming: bool = False) -> float:
+        """
+        Через сколько секунд отправлять хеджирующий запрос: LLM_HEDGE_DELAY, если задан,
+        иначе перцентиль LLM_HEDGE_PERCENTILE недавних задержек того же вида — до первого токена
+        для стриминга, полного ответа без него (не меньше LLM_HEDGE_MIN_DELAY)
+        """
+        if LLM_HEDGE_DELAY > 0:
+            return LLM_HEDGE_DELAY
+        recent = self._recent_first_token if streaming else self._recent_latencies
+        if len(recent) < _HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_INITIAL_DELAY
+        ordered = sorted(recent)
+        index = min(len(ordered) - 1, int(len(ordered) * LLM_HEDGE_PERCENTILE / 100))
+        return max(LLM_HEDGE_MIN_DELAY, ordered[index] / 1000)
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        return [
+            {
+                "name": ep.name,
+                "latency_ms": ep.ewma_latency_ms,
+                "first_token_ms": ep.ewma_first_token_ms,
+                "error_rate": ep.error_rate,
+                "ejected": ep.is_ejected(now),
+            }
+            for ep in self.endpoints
+        ]
+
+
+def is_retryable_error(err: Exception) -> bool:
+    """Ошибки, при которых имеет смысл повторить запрос на другом провайдере: таймауты, сеть, 5xx, 429"""
+    if isinstance(err, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(err, openai.APIStatusError):
+        return err.status_code >= 500
+    return isinstance(err, httpx.TransportError)
+
+
+def load_endpoints(http_client: httpx.AsyncClient) -> list:
+    """
+    Загружает список провайдеров из LLM_ENDPOINTS (JSON), например:
+
+        [{"name": "main", "base_url": "https://openrouter.ai/api/v1", "api_key": "...",
+          "models": {"openai/gpt-4o": "openai/gpt-4o"}},
+         {"name": "backup", "base_url": "https://api.openai.com/v1", "api_key": "...",
+          "models": {"openai/gpt-4o": "gpt-4o"}, "image_urls": false}]
+
+    Если LLM_ENDPOINTS не задан, используется единственный провайдер из LLM_API_BASE_URL / LLM_API_KEY.
+    """
+    if not LLM_ENDPOINTS:
+        return [Endpoint("default", os.getenv("LLM_API_BASE_URL"), os.getenv("LLM_API_KEY"), http_client)]
+
+    endpoints = []
+    for index, item in enumerate(json.loads(LLM_ENDPOINTS)):
+        models = item.get("models")
+        if isinstance(models, list):
+            models = {name: name for name in models}
+        endpoints.append(
+            Endpoint(
+                name=item.get("name") or f"endpoint-{index}",
+                base_url=item["base_url"],
+                api_key=item.get("api_key") or os.getenv("LLM_API_KEY"),
+                http_client=http_client,
+                models=models,
+                image_urls=item.get("image_urls", True),
+            )
+        )
+    return endpoints
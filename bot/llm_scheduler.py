@@ -0,0 +1,210 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+
+from bot.config import LLM_QUEUE_TIMEOUT, LLM_USER_MAX_CONCURRENCY, LLM_USER_MAX_QUEUE
+from bot.llm_settings import get_model_settings
+
+
+class LLMBusyError(Exception):
+    """Очередь к модели переполнена или ожидание слота заняло слишком много времени"""
+
+
+class _UserFlow:
+    """Очередь ожидания и учёт одного пользователя внутри bulkhead"""
+
+    __slots__ = ("waiters", "active", "weight", "finish")
+
+    def __init__(self, weight: float):
+        self.waiters = deque()
+        self.active = 0
+        self.weight = weight
+        self.finish = 0.0  # Виртуальное время, до которого пользователь уже «оплатил» обслуживание
+
+
+class Bulkhead:
+    """
+    Ограничение числа одновременных запросов к модели с ограниченной очередью ожидания.
+
+    Очередь справедливая: у каждого пользователя своя FIFO-очередь, а освободившийся слот
+    получает пользователь с наименьшим виртуальным временем завершения (weighted fair queuing).
+    Каждый выданный слот сдвигает время пользователя на 1 / weight, поэтому пользователь
+    с весом 4 получает в четыре раза больше слотов, чем пользователь с весом 1, но никто не голодает.
+    Дополнительно число одновременных запросов одного пользователя ограничено max_per_user.
+
+    Если все слоты заняты и очередь заполнена, запрос отклоняется сразу (LLMBusyError),
+    а не копится, создавая лавину запросов к провайдеру.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, max_per_user: int = LLM_USER_MAX_CONCURRENCY, max_user_queue: int = LLM_USER_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.max_user_queue = max_user_queue
+        self.active = 0
+        self._queued = 0
+        self._flows = {}
+        self._vtime = 0.0  # Виртуальное время последнего выданного слота
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def resize(self, max_concurrency: int, max_queue: int):
+        """Применяет новые лимиты (например, после изменения строки LLMModel)"""
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._wake()
+
+    def _user_capped(self, flow: _UserFlow) -> bool:
+        return self.max_per_user > 0 and flow.active >= self.max_per_user
+
+    def _grant(self, flow: _UserFlow):
+        self._vtime = max(self._vtime, flow.finish)
+        flow.finish = self._vtime + 1.0 / flow.weight
+        flow.active += 1
+        self.active += 1
+
+    def _next_flow(self):
+        best = None
+        for flow in self._flows.values():
+            if flow.waiters and not self._user_capped(flow) and (best is None or flow.finish < best.finish):
+                best = flow
+        return best
+
+    def _wake(self):
+        # Передаём освободившиеся слоты пользователю с наименьшим виртуальным временем
+        while self.active < self.max_concurrency:
+            flow = self._next_flow()
+            if flow is None:
+                return
+            waiter = flow.waiters.popleft()
+            self._queued -= 1
+            if not waiter.done():
+                self._grant(flow)
+                waiter.set_result(True)
+
+    def _flow(self, user_id: str, weight: float) -> _UserFlow:
+        flow = self._flows.get(user_id)
+        if flow is None:
+            flow = self._flows[user_id] = _UserFlow(weight)
+        flow.weight = weight
+        if not flow.waiters and not flow.active:
+            # Простаивавший пользователь не копит «кредит» и не обгоняет всех остальных
+            flow.finish = max(flow.finish, self._vtime)
+        return flow
+
+    def _forget(self, user_id: str, flow: _UserFlow):
+        if not flow.waiters and not flow.active and self._flows.get(user_id) is flow:
+            del self._flows[user_id]
+
+    async def acquire(self, user_id: str = "", weight: float = 1.0, on_queued: Callable[[int], Awaitable[None]] = None, timeout: float = None):
+        """
+        Занимает слот, при необходимости ожидая в очереди
+
+        Args:
+            user_id: Идентификатор пользователя, от имени которого выполняется запрос
+            weight: Вес пользователя в справедливой очереди (больше — чаще получает слот)
+            on_queued: Корутина, получающая позицию в очереди, если запрос пришлось поставить в очередь
+            timeout: Максимальное время ожидания слота в секундах
+        """
+        flow = self._flow(user_id, max(weight, 0.01))
+        # В очередь встаём, только если впереди есть кто-то, кто может занять слот: ожидающие,
+        # упёршиеся в max_per_user, не должны держать свободные слоты от других пользователей
+        if self.active < self.max_concurrency and not self._user_capped(flow) and self._next_flow() is None:
+            self._grant(flow)
+            return
+        if self._queued >= self.max_queue or (self.max_user_queue > 0 and len(flow.waiters) >= self.max_user_queue):
+            self._forget(user_id, flow)
+            raise LLMBusyError("queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        flow.waiters.append(waiter)
+        self._queued += 1
+        # Свободные слоты сразу раздаются по справедливой очереди — возможно, и этому запросу
+        self._wake()
+        if waiter.done():
+            return
+        try:
+            if on_queued is not None:
+                await on_queued(self._queued)
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._abandon(user_id, flow, waiter)
+            raise LLMBusyError("queue wait timed out")
+        except BaseException:
+            self._abandon(user_id, flow, waiter)
+            raise
+
+    def try_acquire(self, user_id: str = "") -> bool:
+        """
+        Занимает слот, только если он свободен прямо сейчас и в очереди нет запросов, которые могут его занять
+
+        Нужен для дополнительных запросов (хеджирование): они не должны ни ждать, ни обгонять
+        тех в очереди, кто может занять слот.
+        Ограничение max_per_user не применяется — это тот же запрос пользователя.
+        """
+        if self.active >= self.max_concurrency or self._next_flow() is not None:
+            return False
+        self._grant(self._flow(user_id, 1.0))
+        return True
+
+    def _abandon(self, user_id: str, flow: _UserFlow, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # Слот уже был передан этому запросу — возвращаем его
+            self.release(user_id)
+            return
+        waiter.cancel()
+        try:
+            flow.waiters.remove(waiter)
+            self._queued -= 1
+        except ValueError:
+            pass
+        self._forget(user_id, flow)
+
+    def release(self, user_id: str = ""):
+        self.active -= 1
+        flow = self._flows.get(user_id)
+        if flow is not None:
+            flow.active -= 1
+            self._forget(user_id, flow)
+        self._wake()
+
+
+# Отдельный bulkhead для каждой модели: перегрузка одной модели не задерживает запросы к другим
+_bulkheads = {}
+
+
+async def get_bulkhead(model: str) -> Bulkhead:
+    """Возвращает bulkhead модели с актуальными лимитами из llm_models"""
+    settings = await get_model_settings(model)
+    bulkhead = _bulkheads.get(model)
+    if bulkhead is None:
+        bulkhead = _bulkheads[model] = Bulkhead(settings.max_concurrency, settings.max_queue)
+    elif (bulkhead.max_concurrency, bulkhead.max_queue) != (settings.max_concurrency, settings.max_queue):
+        bulkhead.resize(settings.max_concurrency, settings.max_queue)
+    return bulkhead
+
+
+@asynccontextmanager
+async def llm_slot(model: str, user_id: str = "", weight: float = 1.0, on_queued: Callable[[int], Awaitable[None]] = None):
+    """
+    Контекстный менеджер вокруг запроса к LLM: ограничивает параллелизм для модели
+    и справедливо распределяет слоты между пользователями
+
+    Args:
+        model: Модель LLM
+        user_id: Пользователь, от имени которого выполняется запрос
+        weight: Вес пользователя в очереди (см. users.llm_weight и LLM_SUPERUSER_WEIGHT)
+        on_queued: Корутина, получающая позицию в очереди (для обратной связи пользователю)
+
+    Raises:
+        LLMBusyError: если очередь к модели переполнена или слот не освободился за LLM_QUEUE_TIMEOUT
+    """
+    bulkhead = await get_bulkhead(model)
+    await bulkhead.acquire(user_id=user_id, weight=weight, on_queued=on_queued, timeout=LLM_QUEUE_TIMEOUT)
+    try:
+        yield
+    finally:
+        bulkhead.release(user_id)
@@ -0,0 +1,184 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+import asyncpg
+from sqlalchemy import event, func
+from sqlalchemy.future import select
+
+from bot.config import (
+    LLM_DEFAULT_MAX_CONCURRENCY,
+    LLM_DEFAULT_MAX_QUEUE,
+    LLM_IMAGE_DELIVERY,
+    LLM_IMAGE_MAX_EDGE,
+    LLM_SETTINGS_REFRESH_INTERVAL,
+)
+from bot.database import async_session, engine
+from bot.models import LLMConfig, LLMModel
+
+# Глобальный флаг LLM (llm_config) и настройки моделей (llm_models), кэшируемые в памяти процесса.
+# Администратор меняет их редко, поэтому запросы к LLM их из БД не читают: после изменения
+# отправляется NOTIFY в канал LLM_SETTINGS_CHANNEL, и каждый процесс бота и воркера сбрасывает кэш.
+# Периодическое перечитывание раз в LLM_SETTINGS_REFRESH_INTERVAL секунд страхует от потерянных уведомлений.
+LLM_SETTINGS_CHANNEL = "llm_settings"
+_RECONNECT_DELAY = 5  # секунд
+
+_models = {}
+_llm_enabled = False
+_loaded_at = None
+# Увеличивается при каждом сбросе кэша: перечитывание, начатое до сброса, не считается свежим
+_generation = 0
+_refresh_lock = asyncio.Lock()
+_listener_task: asyncio.Task = None
+
+
+@dataclass
+class ModelSettings:
+    """Настройки модели, влияющие на обработку запросов"""
+
+    name: str
+    description: str = ""
+    cache_enabled: bool = True
+    max_concurrency: int = LLM_DEFAULT_MAX_CONCURRENCY
+    max_queue: int = LLM_DEFAULT_MAX_QUEUE
+    image_delivery: str = LLM_IMAGE_DELIVERY  # base64 | url
+    image_max_edge: int = LLM_IMAGE_MAX_EDGE  # Разрешение, которого хватает модели (выбор размера фото Telegram)
+
+
+async def refresh_llm_settings():
+    """Перечитывает глобальный флаг LLM и настройки моделей из БД"""
+    global _models, _llm_enabled, _loaded_at
+    generation = _generation
+    try:
+        async with async_session() as session:
+            result = await session.execute(select(LLMConfig.enabled).order_by(LLMConfig.id).limit(1))
+            enabled = bool(result.scalar())
+            result = await session.execute(select(LLMModel))
+            models = {
+                model.name: ModelSettings(
+                    name=model.name,
+                    description=model.description,
+                    cache_enabled=model.cache_enabled,
+                    max_concurrency=model.max_concurrency or LLM_DEFAULT_MAX_CONCURRENCY,
+                    max_queue=model.max_queue if model.max_queue is not None else LLM_DEFAULT_MAX_QUEUE,
+                    image_delivery=model.image_delivery or LLM_IMAGE_DELIVERY,
+                    image_max_edge=model.image_max_edge or LLM_IMAGE_MAX_EDGE,
+                )
+                for model in result.scalars().all()
+            }
+    except Exception as err:
+        # Остаются прежние значения; следующая попытка — через интервал обновления
+        print(f"Error loading LLM settings: {err}")
+    else:
+        _models, _llm_enabled = models, enabled
+    if generation == _generation:
+        _loaded_at = time.monotonic()
+
+
+async def _ensure_fresh():
+    if _loaded_at is not None and time.monotonic() - _loaded_at <= LLM_SETTINGS_REFRESH_INTERVAL:
+        return
+    async with _refresh_lock:
+        # Пока ждали блокировку, кэш мог обновить другой запрос
+        if _loaded_at is None or time.monotonic() - _loaded_at > LLM_SETTINGS_REFRESH_INTERVAL:
+            await refresh_llm_settings()
+
+
+def invalidate_llm_settings():
+    """Сбрасывает кэш: следующее обращение перечитает настройки из БД"""
+    global _loaded_at, _generation
+    _generation += 1
+    _loaded_at = None
+
+
+async def notify_llm_settings_changed(session):
+    """
+    Сообщает всем процессам, что llm_config или llm_models изменились.
+    Вызывается до commit: PostgreSQL доставляет уведомление только после фиксации транзакции.
+
+    Args:
+        session: Сессия, в которой изменены настройки
+    """
+    if session.bind.dialect.name == "postgresql":
+        await session.execute(select(func.pg_notify(LLM_SETTINGS_CHANNEL, "")))
+    # Текущий процесс сбрасывает кэш сам после фиксации, не дожидаясь уведомления
+    event.listen(session.sync_session, "after_commit", lambda _: invalidate_llm_settings(), once=True)
+
+
+async def is_llm_enabled() -> bool:
+    """Глобальный флаг LLM (False, если в llm_config нет записи)"""
+    await _ensure_fresh()
+    return _llm_enabled
+
+
+async def list_models() -> list:
+    """Модели из llm_models, отсортированные по названию"""
+    await _ensure_fresh()
+    return sorted(_models.values(), key=lambda settings: settings.name)
+
+
+async def get_model_settings(model: str) -> ModelSettings:
+    """
+    Возвращает настройки модели (для моделей, которых нет в llm_models, — значения по умолчанию)
+
+    Args:
+        model: Название модели для API
+
+    Returns:
+        ModelSettings модели
+    """
+    await _ensure_fresh()
+    settings = _models.get(model)
+    return settings if settings is not None else ModelSettings(name=model)
+
+
+def _on_notification(connection, pid, channel, payload):
+    invalidate_llm_settings()
+
+
+async def _listen_loop():
+    # Отдельное соединение вне пула SQLAlchemy: LISTEN действует, пока соединение открыто
+    dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(dsn)
+            terminated = asyncio.Event()
+            connection.add_termination_listener(lambda _: terminated.set())
+            await connection.add_listener(LLM_SETTINGS_CHANNEL, _on_notification)
+            # Уведомления, отправленные, пока соединения не было, потеряны
+            invalidate_llm_settings()
+            while not terminated.is_set():
+                try:
+                    await asyncio.wait_for(terminated.wait(), timeout=LLM_SETTINGS_REFRESH_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Разрыв простаивающего соединения обнаруживается только при обращении к нему
+                    await connection.execute("SELECT 1")
+            print("LLM settings listener connection closed, reconnecting")
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            print(f"LLM settings listener error: {err}")
+        finally:
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        await asyncio.sleep(_RECONNECT_DELAY)
+
+
+def start_llm_settings_listener():
+    """Подписывается на уведомления об изменении настроек LLM (вызывается при старте бота и воркера)"""
+    global _listener_task
+    if engine.dialect.name == "postgresql" and _listener_task is None:
+        _listener_task = asyncio.create_task(_listen_loop())
+
+
+async def stop_llm_settings_listener():
+    """Закрывает соединение с подпиской (вызывается при остановке)"""
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+    _listener_task = None
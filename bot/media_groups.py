@@ -0,0 +1,59 @@
+import asyncio
+from typing import Awaitable, Callable
+
+
+class _MediaGroup:
+    def __init__(self):
+        self.updates = []
+        self.last_added = 0.0
+        self.rejected = False
+        self.task: asyncio.Task = None
+
+
+class MediaGroupCollector:
+    """
+    Собирает сообщения альбома (Telegram присылает каждое фото отдельным update с общим
+    media_group_id) и передаёт их обработчику одним списком
+
+    Альбом считается полным, когда после последнего фото прошло window секунд.
+    """
+
+    def __init__(self, window: float, on_group: Callable[[list], Awaitable[None]]):
+        self._window = window
+        self._on_group = on_group
+        self._groups = {}
+
+    def add(self, key, update) -> bool:
+        """
+        Добавляет сообщение в альбом
+
+        Returns:
+            True, если это первое сообщение альбома
+        """
+        loop = asyncio.get_running_loop()
+        group = self._groups.get(key)
+        first = group is None
+        if first:
+            group = self._groups[key] = _MediaGroup()
+            group.task = loop.create_task(self._collect(key, group))
+        group.updates.append(update)
+        group.last_added = loop.time()
+        return first
+
+    def reject(self, key):
+        """Остальные сообщения альбома будут собраны и отброшены без вызова обработчика"""
+        group = self._groups.get(key)
+        if group is not None:
+            group.rejected = True
+
+    async def _collect(self, key, group: _MediaGroup):
+        loop = asyncio.get_running_loop()
+        while (delay := group.last_added + self._window - loop.time()) > 0:
+            await asyncio.sleep(delay)
+        del self._groups[key]
+        if group.rejected:
+            return
+        try:
+            await self._on_group(sorted(group.updates, key=lambda update: update.message.message_id))
+        except Exception as err:
+            print(f"Error processing media group {key}: {err}")
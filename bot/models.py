@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import JSON, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String, Text, text
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -36,6 +36,7 @@ class User(Base):
     username = Column(String, nullable=True)
     llm_model = Column(String(255), nullable=True, default=None)  # Модель LLM для пользователя
     llm_enabled = Column(Boolean, default=True, nullable=False)  # Флаг включения LLM для пользователя
+    llm_weight = Column(Float, default=1.0, server_default="1", nullable=False)  # Вес в справедливой очереди к LLM
 
 
 class Feedback(Base):
@@ -71,6 +72,13 @@ class LLMRequest(Base):
     prompt = Column(Text, nullable=False)
     response = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    model = Column(String(255), nullable=True)  # Модель, которая дала ответ
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    first_token_ms = Column(Integer, nullable=True)  # Время до первого токена (стриминг)
+    total_ms = Column(Integer, nullable=True)  # Полное время ответа LLM
+    image_hash = Column(String(64), nullable=True)  # SHA-256 изображения, если оно было в запросе
+    source = Column(String(16), nullable=True)  # Откуда ответ: llm, cache или partial (прерванный стриминг)
 
 
 class LLMConfig(Base):
@@ -85,7 +93,21 @@ class UserImage(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.tg_id"), nullable=False)
     image_path = Column(String, nullable=False)  # Путь к изображению в Minio
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # По нему удаляются записи старше IMAGE_RETENTION_DAYS
+    image_hash = Column(String(64), ForeignKey("image_blobs.sha256"), nullable=True, index=True)  # Общий blob (None у старых записей)
+    file_unique_id = Column(String, nullable=True, index=True)  # Telegram file_unique_id исходной фотографии
+
+
+# Изображение в Minio, адресуемое по SHA-256 содержимого; одно на все одинаковые загрузки
+class ImageBlob(Base):
+    __tablename__ = "image_blobs"
+    sha256 = Column(String(64), primary_key=True)
+    object_name = Column(String, nullable=False)
+    content_type = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)  # Число ссылающихся записей user_images
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_referenced_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 
 class LLMModel(Base):
@@ -94,6 +116,48 @@ class LLMModel(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False, unique=True)  # Название модели для API
     description = Column(String, nullable=False)  # Описание модели для отображения в боте
+    cache_enabled = Column(Boolean, default=True, nullable=False)  # Разрешено ли кэширование ответов модели
+    max_concurrency = Column(Integer, nullable=True)  # Максимум одновременных запросов (None — LLM_DEFAULT_MAX_CONCURRENCY)
+    max_queue = Column(Integer, nullable=True)  # Максимальная длина очереди ожидания (None — LLM_DEFAULT_MAX_QUEUE)
+    image_delivery = Column(String(16), nullable=True)  # Передача изображений: base64 | url (None — LLM_IMAGE_DELIVERY)
+    image_max_edge = Column(Integer, nullable=True)  # Разрешение изображений для модели, пикселей (None — LLM_IMAGE_MAX_EDGE)
     
     def __repr__(self):
         return f"<LLMModel(name='{self.name}', description='{self.description}')>"
+
+
+# Кэш ответов LLM (второй уровень, переживает перезапуск бота)
+class LLMResponseCache(Base):
+    __tablename__ = "llm_response_cache"
+    key = Column(String(64), primary_key=True)  # SHA-256 от модели, нормализованного запроса и хэша изображения
+    model = Column(String(255), nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+# Очередь заданий LLM для отдельных процессов-воркеров (LLM_JOB_QUEUE_ENABLED)
+class LLMJob(Base):
+    __tablename__ = "llm_jobs"
+    __table_args__ = (
+        # Частичные индексы под запрос захвата: свободные задания и задания с истёкшей видимостью
+        Index("ix_llm_jobs_queued", "available_at", postgresql_where=text("status = 'queued'")),
+        Index("ix_llm_jobs_running", "locked_until", postgresql_where=text("status = 'running'")),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("users.tg_id"), nullable=False)
+    update_data = Column(JSON, nullable=False)  # Исходный Telegram Update, чтобы воркер мог ответить в чат
+    prompt = Column(Text, nullable=False)
+    model = Column(String(255), nullable=True)  # Модель пользователя (None — модель по умолчанию)
+    image_path = Column(String, nullable=True)  # Изображение в Minio, если оно было в запросе
+    image_paths = Column(JSON, nullable=True)  # Несколько изображений (альбом)
+    user_weight = Column(Float, default=1.0, nullable=False)
+    status = Column(String(16), default="queued", nullable=False)  # queued | running | done | dead
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, nullable=False)
+    available_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # Когда задание можно взять (повтор с задержкой)
+    locked_until = Column(DateTime, nullable=True)  # Окончание видимости для остальных воркеров
+    worker_id = Column(String(64), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
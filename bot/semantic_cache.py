@@ -0,0 +1,164 @@
+import re
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.future import select
+
+from bot.config import (
+    LLM_SEMANTIC_CACHE_CAPACITY,
+    LLM_SEMANTIC_CACHE_DIM,
+    LLM_SEMANTIC_CACHE_ENABLED,
+    LLM_SEMANTIC_CACHE_THRESHOLD,
+    LLM_SEMANTIC_CACHE_TTL,
+)
+from bot.database import async_session
+from bot.llm_cache import cache_stats, is_cacheable_model, normalize_prompt
+from bot.models import LLMRequest
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def embed_prompt(prompt: str, dim: int = LLM_SEMANTIC_CACHE_DIM) -> np.ndarray:
+    """
+    Локальное векторное представление запроса без внешних сервисов.
+
+    Используются хэшированные символьные триграммы слов и сами слова (feature hashing
+    со знаком), вектор нормируется по L2 — косинусная близость сводится к скалярному произведению.
+    """
+    indices = []
+    for word in _WORD_RE.findall(normalize_prompt(prompt)):
+        padded = f" {word} "
+        indices.extend(zlib.crc32(padded[i : i + 3].encode("utf-8")) for i in range(len(padded) - 2))
+        indices.append(zlib.crc32(b"w:" + word.encode("utf-8")))
+
+    vector = np.zeros(dim, dtype=np.float32)
+    if not indices:
+        return vector
+    hashes = np.array(indices, dtype=np.uint32)
+    # Младшие биты — позиция, старший бит — знак (уменьшает смещение от коллизий)
+    signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, hashes % dim, signs)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+class SemanticIndex:
+    """
+    Ограниченный по памяти индекс недавних запросов: матрица capacity x dim (float32),
+    заполняемая по кругу — при переполнении вытесняется самая старая запись.
+    """
+
+    def __init__(self, capacity: int, dim: int, ttl: float = None):
+        self.capacity = capacity
+        self.dim = dim
+        self.ttl = ttl
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._model_ids = np.full(capacity, -1, dtype=np.int32)
+        self._model_index = {}  # имя модели -> числовой id для векторной фильтрации
+        self._responses = [None] * capacity
+        self._expires_at = np.zeros(capacity, dtype=np.float64)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def clear(self):
+        self._model_ids[:] = -1
+        self._responses = [None] * self.capacity
+        self._expires_at[:] = 0
+        self._next = 0
+        self._size = 0
+
+    def add(self, model: str, prompt: str, response: str, age: float = 0.0):
+        """Добавляет запись; age — сколько секунд назад получен ответ (запись живёт ttl с этого момента)"""
+        slot = self._next
+        self._vectors[slot] = embed_prompt(prompt, self.dim)
+        self._model_ids[slot] = self._model_index.setdefault(model, len(self._model_index))
+        self._responses[slot] = response
+        self._expires_at[slot] = time.monotonic() + self.ttl - age if self.ttl else np.inf
+        self._next = (slot + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def search(self, model: str, prompt: str, threshold: float):
+        """Возвращает (ответ, близость) для самого похожего запроса той же модели или (None, близость)"""
+        model_id = self._model_index.get(model)
+        if self._size == 0 or model_id is None:
+            return None, 0.0
+        query = embed_prompt(prompt, self.dim)
+        if not query.any():
+            return None, 0.0
+        scores = self._vectors[: self._size] @ query
+        scores[self._expires_at[: self._size] < time.monotonic()] = -1.0
+        scores[self._model_ids[: self._size] != model_id] = -1.0
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score < threshold:
+            return None, score
+        return self._responses[best], score
+
+
+_index = SemanticIndex(LLM_SEMANTIC_CACHE_CAPACITY, LLM_SEMANTIC_CACHE_DIM, ttl=LLM_SEMANTIC_CACHE_TTL)
+
+
+async def find_similar_response(model: str, prompt: str) -> str:
+    """
+    Ищет ответ на близкий по смыслу (перефразированный) запрос к той же модели
+
+    Args:
+        model: Модель LLM
+        prompt: Текст запроса
+
+    Returns:
+        Сохранённый ответ или None, если похожих запросов нет
+    """
+    if not LLM_SEMANTIC_CACHE_ENABLED or not await is_cacheable_model(model):
+        return None
+    response, _ = _index.search(model, prompt, LLM_SEMANTIC_CACHE_THRESHOLD)
+    if response is not None:
+        cache_stats["semantic_hits"] += 1
+    return response
+
+
+async def remember_response(model: str, prompt: str, response: str):
+    """Добавляет запрос и ответ в семантический индекс"""
+    if not LLM_SEMANTIC_CACHE_ENABLED or not response or not await is_cacheable_model(model):
+        return
+    _index.add(model, prompt, response)
+
+
+async def rebuild_semantic_index():
+    """
+    Перестраивает индекс по последним текстовым запросам из llm_requests (вызывается при старте бота)
+
+    Берутся только ещё не истёкшие полные ответы модели: ответы из кэша и прерванные не повторяются,
+    а срок жизни записи отсчитывается от created_at, а не от момента перестроения.
+    """
+    if not LLM_SEMANTIC_CACHE_ENABLED:
+        return
+    now = datetime.utcnow()
+    query = select(LLMRequest.model, LLMRequest.prompt, LLMRequest.response, LLMRequest.created_at).where(
+        LLMRequest.response.isnot(None),
+        LLMRequest.model.isnot(None),
+        LLMRequest.image_hash.is_(None),
+        # Строки до появления source — ответы модели
+        or_(LLMRequest.source.is_(None), LLMRequest.source == "llm"),
+    )
+    if LLM_SEMANTIC_CACHE_TTL:
+        query = query.where(LLMRequest.created_at > now - timedelta(seconds=LLM_SEMANTIC_CACHE_TTL))
+    async with async_session() as session:
+        result = await session.execute(query.order_by(LLMRequest.created_at.desc()).limit(_index.capacity))
+        rows = result.all()
+
+    _index.clear()
+    # Добавляем от старых к новым, чтобы при вытеснении первыми уходили старые записи
+    for model, prompt, response, created_at in reversed(rows):
+        if response and await is_cacheable_model(model):
+            age = (now - created_at).total_seconds() if created_at else 0.0
+            _index.add(model, prompt, response, age=max(age, 0.0))
+    print(f"Semantic cache rebuilt: {len(_index)} prompts")
@@ -0,0 +1,69 @@
+import asyncio
+from typing import Awaitable, Callable
+
+
+class _Flight:
+    def __init__(self):
+        self.task: asyncio.Task = None
+        self.listeners = []
+        self.last_text = None
+
+    async def broadcast(self, text: str):
+        self.last_text = text
+        for listener in list(self.listeners):
+            try:
+                await listener(text)
+            except Exception as err:
+                print(f"Singleflight listener failed: {err}")
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых запросов, выполняющихся одновременно: первый вызов с ключом
+    запускает работу, остальные ждут тот же результат (или ту же ошибку).
+
+    Работа выполняется в отдельной задаче, поэтому отмена одного из ожидающих
+    (например, первого) не прерывает запрос для остальных.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def _finish(self, key: str, flight: _Flight, task: asyncio.Task):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Забираем исключение, даже если все ожидающие уже отменены
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    async def do(self, key: str, fn: Callable, on_delta: Callable[[str], Awaitable[None]] = None):
+        """
+        Выполняет fn один раз для всех одновременных вызовов с одинаковым ключом
+
+        Args:
+            key: Ключ запроса
+            fn: Корутинная функция fn(on_delta); on_delta передаётся, если вызов потоковый
+            on_delta: Корутина, получающая накопленный текст (все участники получают одни и те же обновления)
+
+        Returns:
+            Кортеж (результат, shared), где shared=True для присоединившихся к уже идущему запросу
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(fn(flight.broadcast if on_delta is not None else None))
+            flight.task.add_done_callback(lambda task: self._finish(key, flight, task))
+
+        if on_delta is not None:
+            flight.listeners.append(on_delta)
+            if flight.last_text:
+                await on_delta(flight.last_text)
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            if on_delta is not None:
+                flight.listeners.remove(on_delta)
@@ -1,12 +1,39 @@
+import asyncio
 import base64
+import functools
+import hashlib
 import io
 import os
 import uuid
-from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
 
+import urllib3
 from minio import Minio
+from minio.commonconfig import CopySource
+from minio.deleteobjects import DeleteObject
 from minio.error import S3Error
-from PIL import Image
+
+from bot.cache import LRUCache
+from bot.config import (
+    IMAGE_CACHE_MAX_BYTES,
+    IMAGE_CACHE_MAX_ENTRIES,
+    IMAGE_CACHE_TTL,
+    MINIO_CONNECT_TIMEOUT,
+    MINIO_IO_THREADS,
+    MINIO_MAX_CONNECTIONS,
+    MINIO_PUBLIC_URL,
+    MINIO_READ_TIMEOUT,
+    MINIO_REGION,
+)
+
+# Общий пул соединений (keep-alive) на весь процесс; ссылка нужна, чтобы закрыть его при остановке
+_minio_http = urllib3.PoolManager(
+    timeout=urllib3.Timeout(connect=MINIO_CONNECT_TIMEOUT, read=MINIO_READ_TIMEOUT),
+    maxsize=MINIO_MAX_CONNECTIONS,
+    retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+)
 
 # Инициализация клиента Minio
 minio_client = Minio(
@@ -14,8 +41,49 @@ minio_client = Minio(
     access_key=os.getenv("MINIO_ROOT_USER"),
     secret_key=os.getenv("MINIO_ROOT_PASSWORD"),
     secure=False,  # Используем HTTP вместо HTTPS для локальной разработки
+    http_client=_minio_http,
 )
 
+# Клиент для подписи ссылок, которые открывает внешний сервис (провайдер LLM): подпись
+# включает адрес хоста, поэтому он должен совпадать с публичным адресом Minio.
+# Регион задан явно, чтобы подпись не требовала обращения к серверу.
+public_minio_client = None
+if MINIO_PUBLIC_URL:
+    _public_url = urlparse(MINIO_PUBLIC_URL)
+    public_minio_client = Minio(
+        _public_url.netloc,
+        access_key=os.getenv("MINIO_ROOT_USER"),
+        secret_key=os.getenv("MINIO_ROOT_PASSWORD"),
+        secure=_public_url.scheme == "https",
+        region=MINIO_REGION,
+    )
+
+# Клиент minio синхронный: все обращения выполняются в ограниченном пуле потоков,
+# чтобы загрузка больших файлов не блокировала event loop
+_executor = ThreadPoolExecutor(max_workers=MINIO_IO_THREADS, thread_name_prefix="minio")
+
+# Недавно загруженные изображения: запрос к LLM сразу после загрузки не скачивает их обратно из Minio
+_recent_images = LRUCache(IMAGE_CACHE_MAX_ENTRIES, ttl=IMAGE_CACHE_TTL, max_bytes=IMAGE_CACHE_MAX_BYTES)
+
+# Размер части multipart-загрузки (минимум S3 — 5 МиБ): больше этого потоковая загрузка в памяти не держит
+_PART_SIZE = 5 * 1024 * 1024
+# Потоковые загрузки не больше этого размера попадают и в кэш недавних изображений
+_STREAM_CACHE_LIMIT = 2 * 1024 * 1024
+# Префикс временных объектов потоковой загрузки
+UPLOADS_PREFIX = "uploads/"
+
+
+async def _run(func, *args, **kwargs):
+    """Выполняет синхронный вызов minio в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def close_minio():
+    """Останавливает пул потоков и закрывает соединения с Minio"""
+    _executor.shutdown(wait=True)
+    _minio_http.clear()
+
 # Имя бакета для хранения изображений
 BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME", "user-images")
 
@@ -23,8 +91,8 @@ BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME", "user-images")
 async def init_minio():
     """Инициализация Minio: создание бакета, если он не существует"""
     try:
-        if not minio_client.bucket_exists(BUCKET_NAME):
-            minio_client.make_bucket(BUCKET_NAME)
+        if not await _run(minio_client.bucket_exists, BUCKET_NAME):
+            await _run(minio_client.make_bucket, BUCKET_NAME)
             print(f"Bucket '{BUCKET_NAME}' created successfully")
         else:
             print(f"Bucket '{BUCKET_NAME}' already exists")
@@ -32,40 +100,206 @@ async def init_minio():
         print(f"Error initializing Minio: {err}")
 
 
-async def save_image(image_data: bytes, user_id: str) -> str:
+def image_object_name(image_hash: str, content_type: str = "image/jpeg") -> str:
+    """Имя объекта в Minio для изображения с заданным SHA-256"""
+    extension = "webp" if content_type == "image/webp" else "jpg"
+    return f"sha256/{image_hash[:2]}/{image_hash}.{extension}"
+
+
+def _object_exists(object_name: str) -> bool:
+    try:
+        minio_client.stat_object(BUCKET_NAME, object_name)
+        return True
+    except S3Error as err:
+        if err.code in ("NoSuchKey", "NoSuchObject"):
+            return False
+        raise
+
+
+async def save_image(image_data: bytes, content_type: str = "image/jpeg", image_hash: str = None) -> str:
     """
-    Сохраняет изображение в Minio
+    Сохраняет изображение в Minio под именем, производным от SHA-256 содержимого.
+    Если такой объект уже есть, повторная загрузка не выполняется.
     
     Args:
         image_data: Байты изображения
-        user_id: ID пользователя
+        content_type: MIME-тип изображения
+        image_hash: SHA-256 изображения, если уже посчитан
         
     Returns:
         Путь к сохраненному изображению
     """
+    file_name, _ = await put_image(image_data, content_type, image_hash=image_hash)
+    return file_name
+
+
+async def put_image(image_data: bytes, content_type: str = "image/jpeg", image_hash: str = None, force: bool = False) -> tuple:
+    """
+    То же, что save_image, но сообщает, был ли объект загружен
+
+    Args:
+        force: Загрузить объект, даже если он уже есть (его может удалить сборщик мусора,
+            если blob без ссылок был создан заново)
+
+    Returns:
+        Кортеж (путь к изображению, True — объект загружен, False — загрузка пропущена)
+    """
     try:
-        # Генерируем уникальное имя файла
-        random_suffix = uuid.uuid4().hex[:8]
-        file_name = f"{user_id}_{random_suffix}.jpg"
+        if image_hash is None:
+            image_hash = await _run(lambda: hashlib.sha256(image_data).hexdigest())
+        file_name = image_object_name(image_hash, content_type)
+        if not force and (file_name in _recent_images or await _run(_object_exists, file_name)):
+            _recent_images.set(file_name, bytes(image_data))
+            return file_name, False
         
         # Создаем объект в Minio
-        minio_client.put_object(
+        await _run(
+            minio_client.put_object,
             bucket_name=BUCKET_NAME,
             object_name=file_name,
             data=io.BytesIO(image_data),
             length=len(image_data),
-            content_type="image/jpeg"
+            content_type=content_type
         )
+        _recent_images.set(file_name, bytes(image_data))
         
-        return file_name
+        return file_name, True
     except S3Error as err:
         print(f"Error saving image to Minio: {err}")
         raise
 
 
+async def _anext(iterator):
+    return await iterator.__anext__()
+
+
+class _HashingStream:
+    """
+    Файлоподобный объект для put_object: в потоке пула забирает чанки из асинхронного
+    итератора (через event loop) и считает SHA-256 и размер на лету
+    """
+
+    def __init__(self, chunks, loop: asyncio.AbstractEventLoop):
+        self._chunks = chunks.__aiter__()
+        self._loop = loop
+        self._buffer = bytearray()
+        self._eof = False
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        # Начало файла сохраняется для кэша, пока файл не превысит _STREAM_CACHE_LIMIT
+        self.head = []
+
+    def _next_chunk(self):
+        try:
+            return asyncio.run_coroutine_threadsafe(_anext(self._chunks), self._loop).result()
+        except StopAsyncIteration:
+            return None
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._next_chunk()
+            if chunk is None:
+                self._eof = True
+                break
+            self.sha256.update(chunk)
+            self.size += len(chunk)
+            if self.head is not None:
+                self.head.append(chunk)
+                if self.size > _STREAM_CACHE_LIMIT:
+                    self.head = None
+            self._buffer.extend(chunk)
+        if size < 0:
+            size = len(self._buffer)
+        with memoryview(self._buffer) as view:
+            data = bytes(view[:size])
+        del self._buffer[:size]
+        return data
+
+
+async def save_image_stream(chunks, content_type: str = "image/jpeg", force: bool = False) -> tuple:
+    """
+    Сохраняет изображение в Minio по мере скачивания, не собирая его в памяти целиком.
+
+    Данные загружаются multipart-запросом во временный объект, SHA-256 считается на лету;
+    затем объект копируется на стороне Minio под имя, производное от хеша (если такого ещё нет).
+
+    Args:
+        chunks: Асинхронный итератор чанков изображения
+        content_type: MIME-тип изображения
+        force: Скопировать объект, даже если он уже есть (см. put_image)
+
+    Returns:
+        Кортеж (путь к сохранённому изображению, SHA-256, размер в байтах,
+        True — объект загружен, False — такой объект уже был)
+    """
+    stream = _HashingStream(chunks, asyncio.get_running_loop())
+    temp_name = f"{UPLOADS_PREFIX}{uuid.uuid4().hex}"
+    try:
+        await _run(
+            minio_client.put_object,
+            bucket_name=BUCKET_NAME,
+            object_name=temp_name,
+            data=stream,
+            length=-1,
+            part_size=_PART_SIZE,
+            # Параллельная загрузка частей читает поток наперёд без ограничения памяти
+            num_parallel_uploads=1,
+            content_type=content_type,
+        )
+        image_hash = stream.sha256.hexdigest()
+        file_name = image_object_name(image_hash, content_type)
+        uploaded = force or (file_name not in _recent_images and not await _run(_object_exists, file_name))
+        if uploaded:
+            await _run(minio_client.copy_object, BUCKET_NAME, file_name, CopySource(BUCKET_NAME, temp_name))
+        if stream.head is not None:
+            _recent_images.set(file_name, b"".join(stream.head))
+        return file_name, image_hash, stream.size, uploaded
+    except S3Error as err:
+        print(f"Error saving image stream to Minio: {err}")
+        raise
+    finally:
+        try:
+            await _run(minio_client.remove_object, BUCKET_NAME, temp_name)
+        except S3Error as err:
+            print(f"Error removing temporary object {temp_name}: {err}")
+
+
+def _remove_objects(object_names: list) -> list:
+    # remove_objects ленивый и сам делит список на запросы DeleteObjects по 1000 объектов
+    return list(minio_client.remove_objects(BUCKET_NAME, (DeleteObject(name) for name in object_names)))
+
+
+async def remove_images(image_paths: list) -> int:
+    """
+    Удаляет объекты из Minio пакетными запросами
+
+    Returns:
+        Число объектов, которые удалить не удалось
+    """
+    for image_path in image_paths:
+        _recent_images.pop(image_path)
+    errors = await _run(_remove_objects, image_paths)
+    for error in errors:
+        print(f"Error removing {error.name} from Minio: {error.code} {error.message}")
+    return len(errors)
+
+
+def _list_stale_uploads(before: datetime) -> list:
+    return [
+        (obj.object_name, obj.size)
+        for obj in minio_client.list_objects(BUCKET_NAME, prefix=UPLOADS_PREFIX, recursive=True)
+        if obj.last_modified is not None and obj.last_modified < before
+    ]
+
+
+async def list_stale_uploads(before: datetime) -> list:
+    """Временные объекты незавершённых потоковых загрузок старше before (aware UTC): список (имя, размер)"""
+    return await _run(_list_stale_uploads, before)
+
+
 async def get_image(image_path: str) -> bytes:
     """
-    Получает изображение из Minio
+    Получает изображение из кэша недавних изображений или из Minio
     
     Args:
         image_path: Путь к изображению
@@ -73,32 +307,49 @@ async def get_image(image_path: str) -> bytes:
     Returns:
         Байты изображения
     """
+    image_data = _recent_images.get(image_path)
+    if image_data is not None:
+        return image_data
     try:
-        response = minio_client.get_object(BUCKET_NAME, image_path)
-        return response.read()
+        image_data = await _run(_read_object, image_path)
+        _recent_images.set(image_path, image_data)
+        return image_data
     except S3Error as err:
         print(f"Error getting image from Minio: {err}")
         raise
+
+
+def _read_object(image_path: str) -> bytes:
+    # Скачивание и чтение тела ответа целиком выполняются в потоке пула
+    response = minio_client.get_object(BUCKET_NAME, image_path)
+    try:
+        return response.read()
     finally:
         response.close()
         response.release_conn()
 
 
-async def get_image_url(image_path: str) -> str:
+async def get_image_url(image_path: str, expires: timedelta = timedelta(hours=1), public: bool = False) -> str:
     """
     Получает временную URL для доступа к изображению
     
     Args:
         image_path: Путь к изображению
+        expires: Время жизни ссылки
+        public: Подписать ссылку для публичного адреса Minio (MINIO_PUBLIC_URL)
         
     Returns:
         Временная URL для доступа к изображению
     """
+    client = public_minio_client if public else minio_client
+    if client is None:
+        raise ValueError("MINIO_PUBLIC_URL is not configured")
     try:
-        url = minio_client.presigned_get_object(
+        url = await _run(
+            client.presigned_get_object,
             bucket_name=BUCKET_NAME,
             object_name=image_path,
-            expires=timedelta(hours=1)
+            expires=expires
         )
         return url
     except S3Error as err:
@@ -118,7 +369,7 @@ async def image_to_base64(image_path: str) -> str:
     """
     try:
         image_data = await get_image(image_path)
-        encoded_image = base64.b64encode(image_data).decode('utf-8')
+        encoded_image = await _run(lambda: base64.b64encode(image_data).decode('utf-8'))
         return encoded_image
     except Exception as err:
         print(f"Error converting image to base64: {err}")
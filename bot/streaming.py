@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from bot.config import LLM_STREAM_EDIT_INTERVAL, LLM_STREAM_EDIT_MIN_CHARS
+
+# Максимальная длина текстового сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAM_PLACEHOLDER = "⏳ Генерирую ответ..."
+STREAM_CURSOR = " ▌"
+EMPTY_RESPONSE_TEXT = "Модель вернула пустой ответ."
+
+
+def split_message(text: str) -> list:
+    """Разбивает текст на части, помещающиеся в одно сообщение Telegram"""
+    text = text or EMPTY_RESPONSE_TEXT
+    return [text[i : i + TELEGRAM_MESSAGE_LIMIT] for i in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)]
+
+
+async def reply_text_chunked(message: Message, text: str, parse_mode: str = "HTML"):
+    """Отвечает на сообщение длинным текстом; при некорректной разметке отправляет его без неё"""
+    for chunk in split_message(text):
+        await _reply_chunk(message, chunk, parse_mode)
+
+
+async def _reply_chunk(message: Message, chunk: str, parse_mode: str = "HTML"):
+    try:
+        await message.reply_text(chunk, parse_mode=parse_mode, reply_to_message_id=message.message_id)
+    except BadRequest:
+        await message.reply_text(chunk, reply_to_message_id=message.message_id)
+
+
+class StreamingReply:
+    """
+    Прогрессивный ответ на сообщение пользователя: сначала отправляется плейсхолдер,
+    затем он редактируется по мере поступления текста от LLM.
+
+    Редактирования объединяются по времени (не чаще interval секунд) и по объёму
+    (не меньше min_chars новых символов), чтобы не упираться в лимиты Telegram
+    на edit_message_text. Запрос на редактирование не блокирует чтение стрима:
+    если предыдущий edit ещё выполняется, промежуточный текст просто пропускается.
+    """
+
+    def __init__(self, message: Message, interval: float = LLM_STREAM_EDIT_INTERVAL, min_chars: int = LLM_STREAM_EDIT_MIN_CHARS):
+        self._source = message
+        self._interval = interval
+        self._min_chars = min_chars
+        self._reply: Message = None
+        self._last_edit_at = 0.0
+        self._last_len = 0
+        self._edit_task: asyncio.Task = None
+
+    async def start(self, text: str = STREAM_PLACEHOLDER):
+        """Отправляет плейсхолдер, который затем будет редактироваться"""
+        self._reply = await self._source.reply_text(text, reply_to_message_id=self._source.message_id)
+        self._last_edit_at = time.monotonic()
+
+    async def set_status(self, text: str):
+        """Показывает служебный статус в плейсхолдере (например, позицию в очереди)"""
+        if self._reply is not None:
+            await self._edit(text)
+
+    async def update(self, text: str):
+        """Передаёт накопленный текст ответа; edit выполняется только если позволяет бюджет"""
+        if self._reply is None or not text.strip():
+            return
+        if self._edit_task is not None and not self._edit_task.done():
+            return
+        now = time.monotonic()
+        if now - self._last_edit_at < self._interval or len(text) - self._last_len < self._min_chars:
+            return
+        self._last_edit_at = now
+        self._last_len = len(text)
+        preview = text[: TELEGRAM_MESSAGE_LIMIT - len(STREAM_CURSOR)] + STREAM_CURSOR
+        self._edit_task = asyncio.create_task(self._edit(preview))
+
+    async def _edit(self, text: str, parse_mode: str = None, final: bool = False):
+        try:
+            await self._reply.edit_text(text, parse_mode=parse_mode)
+        except RetryAfter as err:
+            if final:
+                # Финальный текст терять нельзя — ждём и повторяем
+                await asyncio.sleep(float(err.retry_after))
+                await self._reply.edit_text(text, parse_mode=parse_mode)
+            else:
+                # Telegram просит подождать — откладываем следующие промежуточные edit
+                self._last_edit_at = time.monotonic() + float(err.retry_after)
+        except BadRequest as err:
+            # "Message is not modified" и подобные ошибки для промежуточного текста не критичны
+            if final:
+                raise
+            print(f"Streaming edit skipped: {err}")
+        except TelegramError as err:
+            if final:
+                raise
+            print(f"Streaming edit failed: {err}")
+
+    async def _wait_pending(self):
+        if self._edit_task is not None:
+            await self._edit_task
+            self._edit_task = None
+
+    async def finish(self, text: str, parse_mode: str = "HTML"):
+        """Выводит финальный текст; если он длиннее лимита Telegram, остаток отправляется отдельными сообщениями"""
+        await self._wait_pending()
+        if self._reply is None:
+            await reply_text_chunked(self._source, text, parse_mode=parse_mode)
+            return
+        chunks = split_message(text)
+        try:
+            await self._edit(chunks[0], parse_mode=parse_mode, final=True)
+        except BadRequest:
+            # Модель могла вернуть некорректный HTML — показываем ответ без разметки
+            await self._edit(chunks[0], final=True)
+        for chunk in chunks[1:]:
+            await _reply_chunk(self._source, chunk, parse_mode)
+
+    async def fail(self, text: str):
+        """Заменяет плейсхолдер сообщением об ошибке"""
+        await self._wait_pending()
+        if self._reply is None:
+            await self._source.reply_text(text, reply_to_message_id=self._source.message_id)
+        else:
+            await self._edit(text, final=True)
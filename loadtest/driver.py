@@ -0,0 +1,236 @@
+"""
+Нагрузочный драйвер: прогоняет синтетические Telegram Update через register_handlers с заданной
+частотой и выводит пропускную способность, p50/p95/p99 задержки обработки и число
+SQL-запросов на один update.
+
+Update-ы подаются в app.update_queue и обрабатываются штатным процессором приложения
+с той же настройкой concurrent_updates, что и в main.py (BOT_CONCURRENT_UPDATES), поэтому
+задержка включает ожидание в очереди обновлений, как в боевом боте.
+
+Telegram API подменяется локальной заглушкой (FakeTelegramRequest), LLM — сервером
+loadtest.fake_llm_server (--spawn-fake-llm запускает его в том же процессе).
+Нужна доступная база PostgreSQL из .env (DATABASE_URL / POSTGRES_*).
+
+Запуск:
+    python -m loadtest.driver --spawn-fake-llm --rate 20 --duration 30 --users 200
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram.request import BaseRequest  # noqa: E402
+
+from loadtest.fake_llm_server import add_options_arguments, options_from_args, start_fake_llm_server  # noqa: E402
+
+# Счётчик SQL-запросов текущего update (contextvar наследуется задачами и greenlet-ами SQLAlchemy)
+_query_counter = contextvars.ContextVar("query_counter", default=None)
+
+PROMPTS = [
+    "Что такое LLM?",
+    "Как использовать ChatGPT для учёбы?",
+    "Объясни, что такое промпт-инжиниринг",
+    "Напиши план доклада про нейросети",
+    "Какие есть open-source модели?",
+    "Придумай три идеи для пет-проекта",
+]
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Заглушка Telegram Bot API: отвечает на вызовы локально и считает их по методам"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._message_ids = itertools.count(1_000_000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        params = request_data.parameters if request_data is not None else {}
+
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot", "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        elif api_method in ("sendMessage", "editMessageText", "sendVideo", "sendAnimation", "sendPhoto"):
+            chat_id = params.get("chat_id") or 0
+            result = {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Load", "last_name": f"User{user_id}", "username": f"load{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def pick_text(llm_share: float) -> str:
+    if random.random() < llm_share:
+        return random.choice(PROMPTS)
+    return random.choice(["/start", "О боте", "Основное меню"])
+
+
+async def run(args):
+    # Модули бота читают конфигурацию при импорте, поэтому импортируем их после настройки окружения
+    from sqlalchemy import event
+    from sqlalchemy.future import select
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, TypeHandler
+
+    from bot.config import BOT_CONCURRENT_UPDATES
+    from bot.database import async_session, engine
+    from bot.handlers import register_handlers
+    from bot.llm import close_llm_client, init_llm_client
+    from bot.models import Base, LLMConfig
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_session() as session:
+        config = (await session.execute(select(LLMConfig))).scalars().first()
+        if config is None:
+            session.add(LLMConfig(enabled=True))
+        else:
+            config.enabled = True
+        await session.commit()
+
+    concurrent_updates = args.concurrent_updates or BOT_CONCURRENT_UPDATES
+    telegram_request = FakeTelegramRequest()
+    app = (
+        ApplicationBuilder()
+        .token("123456:LOADTEST")
+        .request(telegram_request)
+        .get_updates_request(FakeTelegramRequest())
+        .concurrent_updates(concurrent_updates)
+        .build()
+    )
+    register_handlers(app)
+
+    total = int(args.rate * args.duration)
+    enqueued = {}
+    latencies = []
+    queries = []
+    errors = Counter()
+    finished = asyncio.Event()
+
+    async def on_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    async def start_update(update: Update, context):
+        # Обработчик выполняется в задаче этого update, счётчик видят все его обработчики
+        _query_counter.set([0])
+
+    async def finish_update(update: Update, context):
+        latencies.append(time.perf_counter() - enqueued.pop(update.update_id))
+        queries.append(_query_counter.get()[0])
+        if len(latencies) == total:
+            finished.set()
+
+    app.add_handler(TypeHandler(Update, start_update), group=-100)
+    app.add_handler(TypeHandler(Update, finish_update), group=100)
+    app.add_error_handler(on_error)
+    await app.initialize()
+    await init_llm_client()
+    await app.start()
+
+    print(f"Sending {total} updates at {args.rate}/s from {args.users} users (concurrent_updates={concurrent_updates})...")
+    started = time.perf_counter()
+    for update_id in range(1, total + 1):
+        user_id = 10_000_000 + random.randrange(args.users)
+        update = Update.de_json(make_update(update_id, user_id, pick_text(args.llm_share)), app.bot)
+        enqueued[update_id] = time.perf_counter()
+        await app.update_queue.put(update)
+        # Открытая модель нагрузки: следующий update уходит по расписанию, не дожидаясь ответа
+        delay = started + update_id / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await finished.wait()
+    elapsed = time.perf_counter() - started
+
+    await app.stop()
+    await close_llm_client()
+    await app.shutdown()
+    await engine.dispose()
+
+    print()
+    print(f"Concurrency:    concurrent_updates={concurrent_updates}")
+    print(f"Updates:        {len(latencies)} in {elapsed:.1f}s ({len(latencies) / elapsed:.1f} updates/s)")
+    print(f"Latency p50:    {percentile(latencies, 50) * 1000:.0f} ms")
+    print(f"Latency p95:    {percentile(latencies, 95) * 1000:.0f} ms")
+    print(f"Latency p99:    {percentile(latencies, 99) * 1000:.0f} ms")
+    print(f"Latency max:    {max(latencies) * 1000:.0f} ms")
+    print(f"DB queries/upd: mean {statistics.mean(queries):.1f}, p95 {percentile(queries, 95)}, max {max(queries)}")
+    print(f"Bot API calls:  {dict(telegram_request.calls)}")
+    print(f"Handler errors: {dict(errors) or 'none'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test driver for the bot handlers")
+    parser.add_argument("--rate", type=float, default=10, help="updates per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--users", type=int, default=100, help="number of synthetic users")
+    parser.add_argument("--llm-share", type=float, default=0.7, help="share of updates that are LLM prompts")
+    parser.add_argument(
+        "--concurrent-updates", type=int, default=0, help="override BOT_CONCURRENT_UPDATES (default: the value main.py uses)"
+    )
+    parser.add_argument("--spawn-fake-llm", action="store_true", help="start loadtest.fake_llm_server in-process")
+    add_options_arguments(parser)
+    args = parser.parse_args()
+
+    if args.spawn_fake_llm:
+        server = start_fake_llm_server(options=options_from_args(args))
+        os.environ["LLM_API_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        os.environ["LLM_API_KEY"] = "loadtest"
+        os.environ["LLM_ENDPOINTS"] = ""
+    os.environ.setdefault("LLM_API_MODEL", "fake-model")
+    # Лимит запросов к LLM не должен ограничивать нагрузочный тест
+    os.environ["DEFAULT_LIMIT_LLM"] = str(10**9)
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
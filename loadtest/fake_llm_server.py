@@ -0,0 +1,206 @@
+"""
+Локальный OpenAI-совместимый сервер-заглушка для нагрузочного тестирования без расхода API-кредитов.
+
+Поддерживает POST .../chat/completions (обычный и stream=True с include_usage), GET .../models,
+настраиваемое распределение задержки, скорость генерации токенов и инъекцию ошибок.
+
+Запуск:
+    python -m loadtest.fake_llm_server --port 8001 --latency lognormal --latency-median 1.5 --error-rate 0.02
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class FakeLLMOptions:
+    latency: str = "lognormal"  # fixed | uniform | lognormal
+    latency_median: float = 1.0  # Задержка до первого токена, секунд
+    latency_sigma: float = 0.5  # Для lognormal
+    latency_max: float = 2.0  # Верхняя граница для uniform
+    completion_tokens: int = 120  # Число «токенов» в ответе
+    token_delay: float = 0.01  # Пауза между чанками при стриминге, секунд
+    error_rate: float = 0.0  # Доля ответов 500
+    rate_limit_rate: float = 0.0  # Доля ответов 429
+    hang_rate: float = 0.0  # Доля запросов, которые «зависают» на hang_seconds (проверка таймаутов)
+    hang_seconds: float = 300.0
+
+    def sample_latency(self) -> float:
+        if self.latency == "fixed":
+            return self.latency_median
+        if self.latency == "uniform":
+            return random.uniform(0, self.latency_max)
+        return random.lognormvariate(math.log(max(self.latency_median, 1e-6)), self.latency_sigma)
+
+
+_WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore".split()
+
+
+def _prompt_tokens(messages: list) -> int:
+    chars = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                chars += len(part.get("text", "")) if part.get("type") == "text" else 1000  # Изображение
+    return max(1, chars // 4)
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящих провайдеров
+    options = FakeLLMOptions()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "loadtest"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        opts = self.options
+        roll = random.random()
+        if roll < opts.hang_rate:
+            time.sleep(opts.hang_seconds)
+        time.sleep(opts.sample_latency())
+        if roll < opts.hang_rate + opts.error_rate:
+            self._send_json(500, {"error": {"message": "injected server error", "type": "server_error"}})
+            return
+        if roll < opts.hang_rate + opts.error_rate + opts.rate_limit_rate:
+            self._send_json(429, {"error": {"message": "injected rate limit", "type": "rate_limit"}}, {"Retry-After": "1"})
+            return
+
+        model = body.get("model", "fake-model")
+        usage = {
+            "prompt_tokens": _prompt_tokens(body.get("messages", [])),
+            "completion_tokens": opts.completion_tokens,
+            "total_tokens": 0,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        words = [random.choice(_WORDS) for _ in range(opts.completion_tokens)]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if index == 0 else " " + word}, "finish_reason": None}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            if opts.token_delay:
+                time.sleep(opts.token_delay)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": [], "usage": usage}
+            self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+def start_fake_llm_server(host: str = "127.0.0.1", port: int = 0, options: FakeLLMOptions = None) -> ThreadingHTTPServer:
+    """
+    Запускает сервер-заглушку в фоновом потоке
+
+    Returns:
+        Экземпляр сервера (адрес — server.server_address, остановка — server.shutdown())
+    """
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {"options": options or FakeLLMOptions()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_options_arguments(parser: argparse.ArgumentParser):
+    defaults = FakeLLMOptions()
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default=defaults.latency)
+    parser.add_argument("--latency-median", type=float, default=defaults.latency_median)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--latency-max", type=float, default=defaults.latency_max)
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--token-delay", type=float, default=defaults.token_delay)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate)
+    parser.add_argument("--hang-rate", type=float, default=defaults.hang_rate)
+    parser.add_argument("--hang-seconds", type=float, default=defaults.hang_seconds)
+
+
+def options_from_args(args: argparse.Namespace) -> FakeLLMOptions:
+    return FakeLLMOptions(
+        latency=args.latency,
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        latency_max=args.latency_max,
+        completion_tokens=args.completion_tokens,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_options_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_fake_llm_server(args.host, args.port, options_from_args(args))
+    print(f"Fake LLM server listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
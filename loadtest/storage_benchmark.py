@@ -0,0 +1,92 @@
+"""
+Бенчмарк отзывчивости event loop во время загрузки больших файлов в Minio.
+
+Параллельно с загрузками работает «тикер», который просыпается каждые 10 мс и замеряет,
+насколько позже запланированного он получил управление (задержка event loop).
+Режим executor использует bot.storage.save_image (пул потоков), режим blocking вызывает
+синхронный minio_client.put_object прямо в корутине, как было раньше.
+Нужен доступный Minio из .env (MINIO_HOST / MINIO_PORT / MINIO_ROOT_USER / MINIO_ROOT_PASSWORD).
+
+Запуск:
+    python -m loadtest.storage_benchmark --uploads 20 --size-mb 8
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from bot.storage import BUCKET_NAME, close_minio, init_minio, minio_client, save_image  # noqa: E402
+from loadtest.driver import percentile  # noqa: E402
+
+TICK = 0.01
+
+
+async def blocking_save_image(image_data: bytes) -> str:
+    file_name = f"benchmark/{hashlib.sha256(image_data).hexdigest()}.jpg"
+    minio_client.put_object(BUCKET_NAME, file_name, io.BytesIO(image_data), len(image_data), content_type="image/jpeg")
+    return file_name
+
+
+async def measure(mode: str, uploads: int, payload: bytes) -> dict:
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            expected = loop.time() + TICK
+            await asyncio.sleep(TICK)
+            lags.append(max(loop.time() - expected, 0.0))
+
+    upload = save_image if mode == "executor" else blocking_save_image
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK)
+    # Содержимое у каждой загрузки своё, иначе save_image пропустит повторы как дубликаты
+    payloads = [index.to_bytes(8, "big") + payload for index in range(uploads)]
+    started = time.perf_counter()
+    names = await asyncio.gather(*(upload(data) for data in payloads))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await ticker_task
+
+    for name in set(names):
+        minio_client.remove_object(BUCKET_NAME, name)
+    return {
+        "elapsed": elapsed,
+        "throughput_mb": uploads * len(payload) / elapsed / 1024 / 1024,
+        "lag_p50": percentile(lags, 50),
+        "lag_p99": percentile(lags, 99),
+        "lag_max": max(lags) if lags else 0.0,
+    }
+
+
+async def run(args):
+    await init_minio()
+    payload = os.urandom(int(args.size_mb * 1024 * 1024))
+    modes = ["executor", "blocking"] if args.mode == "both" else [args.mode]
+    print(f"{args.uploads} concurrent uploads of {args.size_mb} MB")
+    for mode in modes:
+        stats = await measure(mode, args.uploads, payload)
+        print(
+            f"{mode:>9}: {stats['elapsed']:.2f}s, {stats['throughput_mb']:.1f} MB/s, "
+            f"loop lag p50 {stats['lag_p50'] * 1000:.1f} ms, p99 {stats['lag_p99'] * 1000:.1f} ms, "
+            f"max {stats['lag_max'] * 1000:.1f} ms"
+        )
+    close_minio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event loop responsiveness during MinIO uploads")
+    parser.add_argument("--uploads", type=int, default=20, help="number of concurrent uploads")
+    parser.add_argument("--size-mb", type=float, default=8, help="size of each upload")
+    parser.add_argument("--mode", choices=["executor", "blocking", "both"], default="both")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
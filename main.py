@@ -1,11 +1,17 @@
 from telegram import BotCommand
 from telegram.ext import ApplicationBuilder
 
-from bot.config import BOT_TOKEN
+from bot.config import BOT_CONCURRENT_UPDATES, BOT_TOKEN
 from bot.database import engine
 from bot.handlers import register_handlers
+from bot.image_gc import start_image_gc, stop_image_gc
+from bot.image_store import close_telegram_http
+from bot.images import close_image_pool
+from bot.llm import close_llm_client, init_llm_client
+from bot.llm_settings import start_llm_settings_listener, stop_llm_settings_listener
 from bot.models import Base
-from bot.storage import init_minio
+from bot.semantic_cache import rebuild_semantic_index
+from bot.storage import close_minio, init_minio
 
 
 async def on_startup(app):
@@ -14,6 +20,18 @@ async def on_startup(app):
     
     # Инициализация Minio
     await init_minio()
+
+    # Общий LLM-клиент с пулом соединений
+    await init_llm_client()
+
+    # Семантический кэш восстанавливается из истории запросов
+    await rebuild_semantic_index()
+
+    # Периодическая сборка мусора изображений
+    start_image_gc()
+
+    # Уведомления об изменении флага LLM и списка моделей
+    start_llm_settings_listener()
     
     # Оставляем только базовые команды, доступные всем пользователям
     commands = [
@@ -25,8 +43,26 @@ async def on_startup(app):
     print("Бот запущен.")
 
 
+async def on_shutdown(app):
+    await stop_image_gc()
+    await stop_llm_settings_listener()
+    await close_llm_client()
+    await close_telegram_http()
+    close_minio()
+    close_image_pool()
+    await engine.dispose()
+    print("Бот остановлен.")
+
+
 def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).post_init(on_startup).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     register_handlers(app)
     app.run_polling()
 
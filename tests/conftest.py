@@ -0,0 +1,4 @@
+import os
+
+# bot.config читает подключение к БД при импорте; для юнит-тестов хватает значений-заглушек
+os.environ.setdefault("POSTGRES_PORT", "5432")
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from bot.llm_scheduler import Bulkhead
+
+
+def test_capped_user_does_not_block_free_slots():
+    async def scenario():
+        bulkhead = Bulkhead(max_concurrency=8, max_queue=10, max_per_user=2, max_user_queue=3)
+        await bulkhead.acquire("a")
+        await bulkhead.acquire("a")
+        # Третий запрос пользователя A ждёт из-за max_per_user, хотя слоты свободны
+        blocked = asyncio.create_task(bulkhead.acquire("a"))
+        await asyncio.sleep(0)
+        assert bulkhead.active == 2 and bulkhead.queued == 1
+
+        await asyncio.wait_for(bulkhead.acquire("b"), timeout=0.5)
+        assert bulkhead.try_acquire("hedge")
+        assert bulkhead.active == 4 and not blocked.done()
+
+        bulkhead.release("a")
+        await asyncio.wait_for(blocked, timeout=0.5)
+        assert bulkhead.active == 4 and bulkhead.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_free_slot_goes_to_eligible_waiter_first():
+    async def scenario():
+        bulkhead = Bulkhead(max_concurrency=1, max_queue=10, max_per_user=0, max_user_queue=0)
+        await bulkhead.acquire("a")
+        waiting = asyncio.create_task(bulkhead.acquire("b"))
+        await asyncio.sleep(0)
+        assert not bulkhead.try_acquire("hedge")
+
+        bulkhead.release("a")
+        await asyncio.wait_for(waiting, timeout=0.5)
+        # Слот достался ожидавшему, а не пришедшему позже
+        late = asyncio.create_task(bulkhead.acquire("c"))
+        await asyncio.sleep(0)
+        assert not late.done() and bulkhead.queued == 1
+        late.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await late
+
+    asyncio.run(scenario())
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import signal
+import socket
+import uuid
+
+from telegram import Bot, Update
+
+from bot.config import BOT_TOKEN, LLM_JOB_POLL_INTERVAL, LLM_JOB_VISIBILITY_TIMEOUT, LLM_WORKER_CONCURRENCY
+from bot.database import engine
+from bot.db_metrics import finish_query_sample, start_query_sample
+from bot.handlers import answer_with_llm
+from bot.llm import close_llm_client, init_llm_client
+from bot.llm_jobs import claim_llm_job, complete_llm_job, extend_llm_job, fail_llm_job
+from bot.llm_quota import refund_llm_quota
+from bot.llm_settings import start_llm_settings_listener, stop_llm_settings_listener
+from bot.models import LLMJob
+from bot.semantic_cache import rebuild_semantic_index
+from bot.storage import close_minio
+
+# Процесс-воркер очереди заданий LLM (LLM_JOB_QUEUE_ENABLED=true).
+# Можно запустить несколько процессов: задания распределяются через FOR UPDATE SKIP LOCKED.
+
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+async def heartbeat(job: LLMJob):
+    # Продлеваем видимость задания, пока идёт запрос к LLM
+    while True:
+        await asyncio.sleep(LLM_JOB_VISIBILITY_TIMEOUT / 3)
+        try:
+            if not await extend_llm_job(job):
+                return
+        except Exception as err:
+            print(f"Error extending LLM job {job.id}: {err}")
+
+
+async def process_job(bot: Bot, job: LLMJob):
+    start_query_sample()
+    try:
+        await _process_job(bot, job)
+    finally:
+        finish_query_sample()
+
+
+async def _process_job(bot: Bot, job: LLMJob):
+    update = Update.de_json(job.update_data, bot)
+
+    if job.attempts > job.max_attempts:
+        # Предыдущий воркер не завершил задание за отведённые попытки (упал или завис)
+        await fail_llm_job(job, "visibility timeout expired", retry=False)
+        await refund_llm_quota(str(update.effective_user.id))
+        await bot.send_message(update.effective_chat.id, "Ошибка при обращении к LLM API.", reply_to_message_id=update.message.message_id)
+        return
+
+    keepalive = asyncio.create_task(heartbeat(job))
+    try:
+        answered = await answer_with_llm(
+            update,
+            job.prompt,
+            user_model=job.model,
+            image_path=job.image_path,
+            image_paths=job.image_paths,
+            user_weight=job.user_weight,
+            retrying=job.attempts < job.max_attempts,
+        )
+    except Exception as err:
+        retry = await fail_llm_job(job, f"{type(err).__name__}: {err}")
+        print(f"LLM job {job.id} failed (attempt {job.attempts}/{job.max_attempts}, retry={retry}): {err}")
+        if not retry:
+            # Последняя попытка: зарезервированный запрос уже вернул answer_with_llm
+            await bot.send_message(update.effective_chat.id, "Ошибка при обращении к LLM API.", reply_to_message_id=update.message.message_id)
+    else:
+        if answered:
+            await complete_llm_job(job)
+        else:
+            # Пользователь уже получил сообщение об ошибке, задание уходит в dead letter
+            await fail_llm_job(job, "LLM request failed", retry=False)
+    finally:
+        keepalive.cancel()
+
+
+async def worker_loop(bot: Bot, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            job = await claim_llm_job(WORKER_ID)
+        except Exception as err:
+            print(f"Error claiming LLM job: {err}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), LLM_JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await process_job(bot, job)
+        except Exception as err:
+            print(f"Error processing LLM job {job.id}: {err}")
+
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # Текущие задания дорабатываются, новые не берутся
+        loop.add_signal_handler(sig, stop.set)
+
+    await init_llm_client()
+    await rebuild_semantic_index()
+    start_llm_settings_listener()
+    async with Bot(BOT_TOKEN) as bot:
+        print(f"LLM worker {WORKER_ID} started with concurrency {LLM_WORKER_CONCURRENCY}.")
+        await asyncio.gather(*(worker_loop(bot, stop) for _ in range(LLM_WORKER_CONCURRENCY)))
+    await stop_llm_settings_listener()
+    await close_llm_client()
+    close_minio()
+    await engine.dispose()
+    print(f"LLM worker {WORKER_ID} stopped.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())